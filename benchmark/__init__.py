@@ -0,0 +1 @@
+# Synthetic library generator and pipeline benchmarks, run with: python -m benchmark.run_benchmarks
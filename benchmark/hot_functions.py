@@ -0,0 +1,49 @@
+import os
+import sys
+import json
+import time
+from PIL import Image
+
+# Times the functions every page or chapter goes through, on a synthetic library.
+# Prints the results as JSON, used by run_benchmarks.
+
+sample_size = 20
+
+def time_function(function, arguments, min_seconds=1.0):
+    """Calls function over the argument tuples until min_seconds passed, returns calls/s and mean time."""
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        for args in arguments:
+            function(*args)
+        calls += len(arguments)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            break
+    return {"calls": calls, "calls_per_second": calls / elapsed, "mean_ms": elapsed / calls * 1000}
+
+def time_functions(workspace):
+    # Use the copy of the scripts in the workspace, like the stages do
+    sys.path.insert(0, workspace)
+    import border_crop
+    import trimm_pages
+    import last_step
+
+    pages, names = [], []
+    for root, dirs, files in os.walk(os.path.join(workspace, "input")):
+        names.extend(dirs)
+        pages.extend(os.path.join(root, f) for f in sorted(files) if f.endswith(".jpg"))
+    images = []
+    for path in pages[:sample_size]:
+        with Image.open(path) as img:
+            images.append(img.convert("RGB"))
+
+    colors = [(img, trimm_pages.get_margin_color(img, None)) for img in images]
+    return {
+        "get_border_color": time_function(border_crop.get_border_color, [(img,) for img in images]),
+        "find_crop_bounds": time_function(trimm_pages.find_crop_bounds, [(img, color, 150) for img, color in colors]),
+        "parse_title": time_function(last_step.parse_title, [(name,) for name in names]),
+    }
+
+if __name__ == "__main__":
+    print(json.dumps(time_functions(sys.argv[1])))
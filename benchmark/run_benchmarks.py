@@ -0,0 +1,191 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+import metrics
+
+# Runs the pipeline stage by stage on a synthetic library and saves
+# time, throughput, peak RSS and bytes written of each stage as JSON.
+#
+# A child process starts out with the peak RSS of the process that started it,
+# so this one only uses the standard library (and metrics, which does too) and
+# does the heavy work (generating pages, timing functions) in child processes as well.
+# Peak RSS and bytes written come from os.wait4, without it (Windows) they are None.
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+results_dir = os.path.join(repo_dir, "benchmark", "results")
+
+unpack_driver = "import sys, cbz_unpack\nfor directory in sys.argv[1:]:\n    cbz_unpack.extract_cbz_to_folders(directory)"
+
+def tree_stats(path):
+    """Number of files and their total size below path."""
+    files = size = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                size += os.stat(os.path.join(root, name)).st_size
+                files += 1
+            except FileNotFoundError:
+                pass
+    return files, size
+
+def run_stage(command, workspace, stdin=None):
+    """
+    Runs one stage in its own process. Returns wall time, the peak RSS of the
+    process (and its worker processes) and the bytes it wrote, as seen by the
+    kernel; those two are None where os.wait4 isn't available.
+    """
+    env = {**os.environ, "PYTHONPATH": workspace}
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        command, cwd=workspace, env=env, stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    process.stdin.write(stdin or "")
+    process.stdin.close()
+    stderr = process.stderr.read()
+    if hasattr(os, "wait4"):
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    else:
+        usage = None
+        process.wait()
+    elapsed = time.perf_counter() - start
+
+    if process.returncode != 0:
+        raise RuntimeError(f"{' '.join(command)} failed:\n{stderr}")
+    return {
+        "seconds": elapsed,
+        "peak_rss_mb": metrics.maxrss_mb(usage.ru_maxrss) if usage else None,
+        "bytes_written": usage.ru_oublock * 512 if usage else None,
+    }
+
+def stage_commands(workspace, series_count):
+    """(stage, command, stdin, folder it works on) in pipeline order."""
+    input_dir = os.path.join(workspace, "input")
+    series_dirs = sorted(os.path.join(input_dir, d) for d in os.listdir(input_dir))
+    python = sys.executable
+
+    # clean_up_folders and trimm_pages work on the folder they are placed in
+    for script in ("clean_up_folders.py", "trimm_pages.py"):
+        shutil.copy(os.path.join(workspace, script), input_dir)
+
+    return [
+        ("cbz_unpack", [python, "-c", unpack_driver, *series_dirs], None, "input"),
+        ("clean_up_folders", [python, os.path.join(input_dir, "clean_up_folders.py")], None, "input"),
+        ("trimm_pages", [python, os.path.join(input_dir, "trimm_pages.py"), "--jobs", str(os.cpu_count() or 1)], None, "input"),
+        ("initiall_prepare", [python, "initiall_prepare.py", "--batch"], None, "output"),
+        # Scan every series, 3 digit chapter numbers, keep output/
+        ("last_step", [python, "last_step.py"], "y\n3\nn\n" * series_count, "manga"),
+    ]
+
+def run_pipeline(workspace, summary):
+    stages = {}
+    for stage, command, stdin, folder in stage_commands(workspace, summary["series"]):
+        _, bytes_before = tree_stats(os.path.join(workspace, "input"))
+        result = run_stage(command, workspace, stdin)
+        files, size = tree_stats(os.path.join(workspace, folder))
+
+        result["pages_per_second"] = summary["pages"] / result["seconds"]
+        result["mb_per_second"] = bytes_before / 1024 / 1024 / result["seconds"]
+        result["files"] = files
+        result["output_bytes"] = size
+        stages[stage] = result
+        usage = "" if result["peak_rss_mb"] is None else (
+            f", peak RSS {result['peak_rss_mb']:.0f} MB, {result['bytes_written'] / 1024 / 1024:.1f} MB written")
+        print(f"{stage}: {result['seconds']:.2f}s, {result['pages_per_second']:.1f} pages/s{usage}")
+    return stages
+
+def generate(workspace, config_path):
+    command = [sys.executable, "-m", "benchmark.synthetic_library", workspace]
+    if config_path:
+        command += ["--config", os.path.abspath(config_path)]
+    output = subprocess.run(command, cwd=repo_dir, capture_output=True, text=True, check=True).stdout
+    return json.loads(output)
+
+def run_functions(workspace):
+    # Timed in a separate process too, so decoded sample pages don't count towards the stages' peak RSS
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmark.hot_functions", workspace],
+        cwd=repo_dir, capture_output=True, text=True, check=True
+    ).stdout
+    functions = json.loads(output)
+    for name, result in functions.items():
+        print(f"{name}: {result['calls_per_second']:,.0f} calls/s ({result['mean_ms']:.3f} ms per call)")
+    return functions
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=repo_dir, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+def compare(previous_path, results):
+    with open(previous_path, encoding="utf-8") as f:
+        previous = json.load(f)
+    print(f"\nCompared to {previous_path}:")
+    for group, key in (("stages", "seconds"), ("functions", "mean_ms")):
+        for name, result in results[group].items():
+            if name in previous.get(group, {}):
+                ratio = previous[group][name][key] / result[key]
+                print(f"  {name}: {ratio:.2f}x {'faster' if ratio >= 1 else 'slower'}")
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark every pipeline stage on a synthetic library')
+    parser.add_argument('--config', help='JSON file overriding the synthetic library config')
+    parser.add_argument('--out', help='Results file (default: benchmark/results/<time>.json)')
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    parser.add_argument('--keep', action='store_true', help='Keep the workspace instead of deleting it')
+
+    args = parser.parse_args()
+
+    workspace = tempfile.mkdtemp(prefix="manga-benchmark-")
+    try:
+        # The scripts find their folders relative to themselves, so they run from a copy
+        for name in os.listdir(repo_dir):
+            if name.endswith(".py"):
+                shutil.copy(os.path.join(repo_dir, name), workspace)
+
+        start = time.perf_counter()
+        summary = generate(workspace, args.config)
+        print(f"Generated {summary['pages']} pages in {summary['chapters']} chapters "
+              f"({time.perf_counter() - start:.1f}s)")
+
+        functions = run_functions(workspace)
+        stages = run_pipeline(workspace, summary)
+    finally:
+        if args.keep:
+            print(f"Workspace kept in {workspace}")
+        else:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    results = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": summary.pop("config"),
+        "library": summary,
+        "stages": stages,
+        "functions": functions,
+    }
+
+    out = args.out or os.path.join(results_dir, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {out}")
+
+    if args.compare:
+        compare(args.compare, results)
+
+if __name__ == "__main__":
+    main()
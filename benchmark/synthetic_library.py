@@ -0,0 +1,148 @@
+import io
+import os
+import zipfile
+import numpy as np
+from PIL import Image
+
+# Deterministic fake library in the layout the scripts expect:
+#   input/<series>/<chapter folders or .cbz>, volume_maps/<series>.txt, covers/<series>/<volume>.jpg
+# The same config and seed always give the same files.
+
+default_config = {
+    "seed": 1,
+    "series": 2,
+    "chapters": 12,            # per series
+    "pages": 10,               # per chapter
+    "page_size": (900, 1350),
+    "chapters_per_volume": 4,
+    "unassigned_chapters": 2,  # last chapters of a series have no volume in their name
+    "border_colors": ["#FFFFFF", "#000000", "#F4F1E8"],
+    "margin": 0.06,            # border width as a share of the page size
+    "noise": 6,                # +- noise added to the border color, 0 for clean margins
+    "grayscale_share": 0.5,    # share of pages saved as grayscale JPEGs
+    "duplicate_share": 0.25,   # share of chapters uploaded a second time by another translator
+    "cbz_share": 0.3,          # share of chapters stored as .cbz instead of a folder
+    "junk_files": 1,           # non-image files per chapter folder, for clean_up_folders
+    "quality": 90,
+}
+
+translators = ["Alpha Scans", "Beta Team", "Gamma Group"]
+
+def hex_to_rgb(hex_color):
+    hex_color = hex_color.lstrip("#")
+    return tuple(int(hex_color[i:i + 2], 16) for i in (0, 2, 4))
+
+def make_page(rng, config):
+    """One page: a border in one of the border colors around random panels."""
+    width, height = config["page_size"]
+    border = np.array(hex_to_rgb(config["border_colors"][rng.integers(len(config["border_colors"]))]), dtype=np.int16)
+    pixels = np.empty((height, width, 3), dtype=np.int16)
+    pixels[:] = border
+
+    if config["noise"]:
+        pixels += rng.integers(-config["noise"], config["noise"] + 1, size=(height, width, 1), dtype=np.int16)
+
+    # Content area with a few flat panels and some texture
+    margin_x, margin_y = int(width * config["margin"]), int(height * config["margin"])
+    content = pixels[margin_y:height - margin_y, margin_x:width - margin_x]
+    content[:] = rng.integers(60, 200)
+    for _ in range(int(rng.integers(2, 6))):
+        top, left = rng.integers(0, content.shape[0] // 2), rng.integers(0, content.shape[1] // 2)
+        bottom, right = top + rng.integers(20, content.shape[0] // 2), left + rng.integers(20, content.shape[1] // 2)
+        content[top:bottom, left:right] = rng.integers(0, 256, size=3)
+    content += rng.integers(-20, 21, size=content.shape[:2] + (1,), dtype=np.int16)
+
+    img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), "RGB")
+    if rng.random() < config["grayscale_share"]:
+        img = img.convert("L")
+    return img
+
+def encode_page(img, quality):
+    data = io.BytesIO()
+    img.save(data, "JPEG", quality=quality)
+    return data.getvalue()
+
+def chapter_names(series_index, config):
+    """(name, volume or None) of every chapter upload of a series, duplicates included."""
+    names = []
+    assigned = config["chapters"] - config["unassigned_chapters"]
+    for chapter in range(1, config["chapters"] + 1):
+        volume = (chapter - 1) // config["chapters_per_volume"] + 1 if chapter <= assigned else None
+        uploads = [translators[series_index % len(translators)]]
+        # Every n-th chapter also exists from a second translator
+        if config["duplicate_share"] and chapter % max(1, round(1 / config["duplicate_share"])) == 0:
+            uploads.append(translators[(series_index + 1) % len(translators)])
+        for translator in uploads:
+            prefix = f"Vol.{volume:02d} " if volume else ""
+            names.append((f"{prefix}Ch.{chapter:04d} - Chapter Title {chapter} (en) [{translator}]", volume))
+    return names
+
+def generate_library(root, config=None):
+    """
+    Writes the library into root and returns a summary: the full config,
+    series, chapters, pages and bytes of page data written.
+    """
+    config = {**default_config, **(config or {})}
+    rng = np.random.default_rng(config["seed"])
+    summary = {"config": config, "series": 0, "chapters": 0, "cbz_chapters": 0, "pages": 0, "page_bytes": 0}
+
+    for series_index in range(config["series"]):
+        series = f"Series {series_index + 1:02d}"
+        series_dir = os.path.join(root, "input", series)
+        os.makedirs(series_dir, exist_ok=True)
+        summary["series"] += 1
+
+        volumes = set()
+        for name, volume in chapter_names(series_index, config):
+            volumes.add(volume)
+            pages = [encode_page(make_page(rng, config), config["quality"]) for _ in range(config["pages"])]
+            summary["chapters"] += 1
+            summary["pages"] += len(pages)
+            summary["page_bytes"] += sum(len(page) for page in pages)
+
+            if rng.random() < config["cbz_share"]:
+                summary["cbz_chapters"] += 1
+                with zipfile.ZipFile(os.path.join(series_dir, f"{name}.cbz"), "w", zipfile.ZIP_STORED) as cbz_file:
+                    for index, page in enumerate(pages, 1):
+                        # Fixed timestamps, so archives are byte-identical between runs
+                        cbz_file.writestr(zipfile.ZipInfo(f"{index:03d}.jpg", date_time=(2020, 1, 1, 0, 0, 0)), page)
+                continue
+
+            chapter_dir = os.path.join(series_dir, name)
+            os.makedirs(chapter_dir, exist_ok=True)
+            for index, page in enumerate(pages, 1):
+                with open(os.path.join(chapter_dir, f"{index:03d}.jpg"), "wb") as f:
+                    f.write(page)
+            for index in range(config["junk_files"]):
+                with open(os.path.join(chapter_dir, f"info{index}.txt"), "w") as f:
+                    f.write("downloaded by a synthetic library\n")
+
+        # Chapters without a volume in their name go to Vol.X
+        volume_maps = os.path.join(root, "volume_maps")
+        os.makedirs(volume_maps, exist_ok=True)
+        with open(os.path.join(volume_maps, f"{series}.txt"), "w", encoding="utf-8") as f:
+            f.write(f"X from {config['chapters'] - config['unassigned_chapters'] + 1}\n")
+
+        covers_dir = os.path.join(root, "covers", series)
+        os.makedirs(covers_dir, exist_ok=True)
+        for volume in sorted(v for v in volumes if v):
+            with open(os.path.join(covers_dir, f"{volume}.jpg"), "wb") as f:
+                f.write(encode_page(make_page(rng, config), config["quality"]))
+
+    return summary
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='Write a synthetic manga library for benchmarks')
+    parser.add_argument('root', help='Folder to write input/, volume_maps/ and covers/ into')
+    parser.add_argument('--config', help='JSON file overriding the default config')
+
+    args = parser.parse_args()
+
+    config = None
+    if args.config:
+        with open(args.config, encoding="utf-8") as f:
+            config = json.load(f)
+    print(json.dumps(generate_library(args.root, config)))
@@ -0,0 +1,125 @@
+import numpy as np
+from collections import Counter
+
+# Shared border detection and cropping used by initiall_prepare and trimm_pages.
+# Only edges and row bands are ever converted to arrays, never the whole page.
+
+# How many pixels find_bbox compares at once
+band_pixels = 1 << 18
+
+def hex_to_rgb(hex_color):
+    hex_color = hex_color.lstrip('#')
+    return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+
+def to_array(img):
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return np.asarray(img, dtype=np.int32)
+
+def edge_mode_color(img):
+    """
+    Most common color along the four edges of the image.
+    Counts packed 24-bit colors in a single pass, so it stays linear
+    no matter how many distinct colors the edges have.
+    """
+    width, height = img.size
+    edges = np.concatenate([
+        to_array(img.crop(box)).reshape(-1, 3)
+        for box in ((0, 0, width, 1), (0, height - 1, width, height), (0, 0, 1, height), (width - 1, 0, width, height))
+    ])
+    packed = (edges[:, 0] << 16) | (edges[:, 1] << 8) | edges[:, 2]
+
+    color, _ = Counter(packed.tolist()).most_common(1)[0]
+    return ((color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF)
+
+def corner_vote_color(img):
+    """
+    Color shared by at least two corners. If all corners differ, the corner
+    closest to white or black (whichever the average leans to) is used.
+    """
+    width, height = img.size
+    corners = [
+        tuple(to_array(img.crop((x, y, x + 1, y + 1)))[0, 0].tolist())
+        for x, y in (
+            (0, 0),                      # Top-left
+            (width - 1, 0),              # Top-right
+            (0, height - 1),             # Bottom-left
+            (width - 1, height - 1),     # Bottom-right
+        )
+    ]
+
+    most_common_color, most_common_count = Counter(corners).most_common(1)[0]
+    if most_common_count >= 2:
+        return most_common_color
+
+    avg_color = tuple(sum(channel) // len(corners) for channel in zip(*corners))
+
+    # Determine if the average color is closer to white or black
+    is_closer_to_white = sum(avg_color) / 3 > 127.5
+    target_color = (255, 255, 255) if is_closer_to_white else (0, 0, 0)
+    return min(
+        corners,
+        key=lambda color: sum((c - tc) ** 2 for c, tc in zip(color, target_color))
+    )
+
+# Border color strategies by name, add new ones here
+strategies = {
+    'edge': edge_mode_color,
+    'corner': corner_vote_color,
+}
+
+def get_border_color(img, strategy='edge'):
+    """
+    Detects the border color with the given strategy.
+    Strategy is a name from `strategies` or a fixed hex color like "#FFFFFF".
+    """
+    if strategy.startswith('#'):
+        return hex_to_rgb(strategy)
+    return strategies[strategy](img)
+
+def content_profile(img, border_color, tolerance=0):
+    """
+    Which rows and which columns have pixels farther than `tolerance` from
+    the border color, as two boolean arrays. The image is compared in bands
+    of rows, so memory use doesn't grow with its height.
+    """
+    width, height = img.size
+    border = np.array(border_color[:3], dtype=np.int32)
+    band_rows = max(1, band_pixels // width)
+
+    content_rows = np.zeros(height, dtype=bool)
+    content_cols = np.zeros(width, dtype=bool)
+    for start in range(0, height, band_rows):
+        band = to_array(img.crop((0, start, width, min(height, start + band_rows))))
+
+        # Squared color distance of every pixel to the border color
+        content = ((band - border) ** 2).sum(axis=2) > tolerance ** 2
+
+        content_rows[start:start + len(content)] = content.any(axis=1)
+        content_cols |= content.any(axis=0)
+
+    return content_rows, content_cols
+
+def find_bbox(img, border_color, tolerance=0):
+    """
+    Returns the (left, top, right, bottom) box of everything farther than
+    `tolerance` from the border color, or None if the whole image is border.
+    """
+    content_rows, content_cols = content_profile(img, border_color, tolerance)
+
+    rows = np.flatnonzero(content_rows)
+    if not rows.size:
+        return None
+    cols = np.flatnonzero(content_cols)
+    return (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+
+def crop(img, strategy='edge', tolerance=0):
+    """
+    Crops the border off the image. Returns the cropped image (in RGB) and the border color.
+    Only the cropped part is converted, the page itself is never copied whole.
+    """
+    border_color = get_border_color(img, strategy)
+    cropped = img.crop(find_bbox(img, border_color, tolerance))
+    if cropped.mode != 'RGB':
+        cropped = cropped.convert('RGB')
+    return cropped, border_color
@@ -1,56 +1,91 @@
 import os
 import zipfile
 import shutil
+import metrics
+
+image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff'}
+
+# Size of the chunks members are streamed in
+chunk_size = 1024 * 1024
 
 def extract_cbz_to_folders(directory):
     """
-    Extracts all .cbz files in the given directory into folders with the same name
-    and removes non-image files and empty directories from those folders.
+    Extracts the images of all .cbz files in the given directory into folders
+    with the same name. Non-image members are never written.
     """
-    image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff'}
-
-    for file in os.listdir(directory):
+    with metrics.timer("scan"):
+        files = os.listdir(directory)
+    for file in files:
         if file.endswith('.cbz'):
             cbz_path = os.path.join(directory, file)
             folder_name = os.path.splitext(file)[0]
             extract_path = os.path.join(directory, folder_name)
-            
+
             # Create a folder for extraction
             os.makedirs(extract_path, exist_ok=True)
-            
+
             # Extract the .cbz file (it's essentially a .zip file)
-            with zipfile.ZipFile(cbz_path, 'r') as cbz_file:
-                cbz_file.extractall(extract_path)
-            
-            print(f"Extracted '{file}' to folder '{folder_name}'")
-            
-            # Clean up the extracted folder
-            clean_extracted_folder(extract_path, image_extensions)
-
-    print("Extraction and cleanup complete.")
-
-def clean_extracted_folder(folder, image_extensions):
-    """
-    Removes all non-image files and empty directories in the given folder.
-    """
-    for root, dirs, files in os.walk(folder, topdown=False):
-        # Remove non-image files
-        for file in files:
-            file_path = os.path.join(root, file)
-            if not os.path.splitext(file)[1].lower() in image_extensions:
-                os.remove(file_path)
-                print(f"Removed non-image file: {file_path}")
-        
-        # Remove empty directories
-        for dir_name in dirs:
-            dir_path = os.path.join(root, dir_name)
-            if not os.listdir(dir_path):  # Check if directory is empty
-                os.rmdir(dir_path)
-                print(f"Removed empty directory: {dir_path}")
+            with metrics.timer("archive"), zipfile.ZipFile(cbz_path, 'r') as cbz_file:
+                count = extract_images(cbz_file, extract_path)
+
+            print(f"Extracted {count} images from '{file}' to folder '{folder_name}'")
+
+    print("Extraction complete.")
+
+def get_image_members(cbz_file):
+    """
+    Picks the image members from the zip central directory, without reading any data.
+    """
+    return [
+        info for info in cbz_file.infolist()
+        if not info.is_dir() and os.path.splitext(info.filename)[1].lower() in image_extensions
+    ]
+
+def flat_names(members):
+    """
+    Maps each member to a file name directly in the extraction folder.
+    Nested paths are joined with '_' only if plain file names would collide,
+    names that still collide ("a_b/c.jpg", "a/b_c.jpg") get _2, _3, ...
+    Names are compared case-insensitively, like Windows does.
+    """
+    names = [os.path.basename(info.filename) for info in members]
+    if len({name.lower() for name in names}) == len(names):
+        return names
+
+    unique = []
+    used = set()
+    for info in members:
+        name = info.filename.strip('/').replace('/', '_')
+        base, ext = os.path.splitext(name)
+        number = 2
+        while name.lower() in used:
+            name = f"{base}_{number}{ext}"
+            number += 1
+        used.add(name.lower())
+        unique.append(name)
+    return unique
+
+def extract_images(cbz_file, extract_path):
+    """
+    Streams every image member into extract_path in fixed-size chunks.
+    """
+    members = get_image_members(cbz_file)
+    for info, name in zip(members, flat_names(members)):
+        with metrics.timer("unpack"), cbz_file.open(info) as src, open(os.path.join(extract_path, name), 'wb') as dst:
+            shutil.copyfileobj(src, dst, chunk_size)
+        metrics.add_bytes("unpack", info.file_size)
+    return len(members)
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Extract the images of every .cbz file next to this script')
+    metrics.add_arguments(parser)
+
+    args = parser.parse_args()
+
     # Get the directory of the script
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    
-    # Extract and clean all .cbz files in the same directory as the script
-    extract_cbz_to_folders(script_dir)
+
+    # Extract all .cbz files in the same directory as the script
+    metrics.run(extract_cbz_to_folders, args, script_dir)
@@ -0,0 +1,122 @@
+import os
+import re
+import time
+from collections import namedtuple
+
+# One grammar for every chapter naming scheme the scripts deal with:
+#   MangaDex / Mihon:  Vol.01 Ch.0001.5 - <title> (en) [<translator>]
+#   MangaFire:         Chapter 1_ <title>.cbz
+#   MangaPlus:         MANGA Plus_#007 - Chapter 7_ <title>.cbz  (#ex = extra after the previous chapter)
+name_pattern = re.compile(r"""
+    ^(?:
+        MANGA\ Plus_\#(?P<plus_number>\d+|ex)(?:\ -\ Chapter\ [^_]*)?(?:_\s*(?P<plus_title>.*?))?
+      | Chapter\ (?P<fire_number>\d+)(?:\.(?P<fire_part>\d+))?(?:_\s*(?P<fire_title>.*?))?
+      | (?:Vol\.(?P<volume>\S+)\ +)?Ch\.(?P<chapter>\d+)(?:\.(?P<part>\d+))?
+        (?:\ -\ (?P<title>.*?))?(?P<tags>(?:\ *(?:\([^()]*\)|\[[^\[\]]*\]))*)
+    )
+    \s*(?:\.cbz)?$
+""", re.VERBOSE | re.IGNORECASE)
+
+# (language) and [translator] groups after a MangaDex title, there can be several
+tag_pattern = re.compile(r"\(([^()]*)\)|\[([^\[\]]*)\]")
+
+ChapterName = namedtuple("ChapterName", "volume chapter part title language translator source")
+
+def clean_title(title):
+    # Everything from the first ( or [ on is a tag, not the title
+    if '(' in title:
+        title = title.split('(')[0]
+    elif '[' in title:
+        title = title.split('[')[0]
+    return title.strip() or None
+
+def parse_name(name):
+    """
+    Parses one chapter folder or file name. Returns a ChapterName, or None if
+    the name doesn't follow any known scheme. MangaPlus "#ex" chapters only
+    get a number from the chapter before them, use parse_names for those.
+    """
+    record = match_name(name)
+    return record if record is not None and record.chapter is not None else None
+
+def match_name(name):
+    """Like parse_name, but MangaPlus "#ex" chapters come back with chapter None."""
+    match = name_pattern.match(name)
+    if not match:
+        return None
+    groups = match.groupdict()
+
+    if groups["plus_number"] is not None:
+        number = groups["plus_number"]
+        chapter = None if number.lower() == "ex" else int(number)
+        return ChapterName(None, chapter, 0, groups["plus_title"] or None, "en", None, "mangaplus")
+
+    if groups["fire_number"] is not None:
+        part = groups["fire_part"]
+        return ChapterName(None, int(groups["fire_number"]), int(part) if part else 0,
+                           groups["fire_title"], "en", None, "mangafire")
+
+    part = groups["part"]
+    title = groups["title"]
+    # The last (...) is the language and the last [...] the translator, like "(en) [Group]"
+    languages = [language for language, _ in tag_pattern.findall(groups["tags"]) if language]
+    translators = [translator for _, translator in tag_pattern.findall(groups["tags"]) if translator]
+    return ChapterName(groups["volume"], int(groups["chapter"]), int(part) if part else 0,
+                       clean_title(title + groups["tags"]) if title is not None else None,
+                       languages[-1] if languages else None, translators[-1] if translators else None, "mangadex")
+
+def parse_names(names):
+    """
+    Parses a whole listing in one call, in the given order.
+    MangaPlus "#ex" chapters become the next part of the chapter before them
+    (or None if there is none).
+    """
+    records = []
+    previous = None
+    for name in names:
+        record = match_name(name)
+        if record is not None and record.chapter is None:
+            record = record._replace(chapter=previous.chapter, part=previous.part + 1) if previous else None
+        if record is not None:
+            previous = record
+        records.append(record)
+    return records
+
+def parse_directory(directory):
+    """Returns {name: ChapterName or None} for a sorted directory listing."""
+    names = sorted(os.listdir(directory))
+    return dict(zip(names, parse_names(names)))
+
+def chapter_number(record):
+    """Chapter and part as one number, e.g. 12.5. None if the record has no chapter."""
+    if record.chapter is None:
+        return None
+    return float(f"{record.chapter}.{record.part}")
+
+def format_chapter(record):
+    """Ch.0001 or Ch.0001.5, as used in MangaDex style names."""
+    return f"Ch.{record.chapter:04d}.{record.part}" if record.part else f"Ch.{record.chapter:04d}"
+
+def benchmark(count=100_000):
+    names = []
+    for i in range(count):
+        chapter = i % 2000
+        kind = i % 4
+        if kind == 0:
+            names.append(f"Vol.{chapter // 10:02d} Ch.{chapter:04d} - Some Title {i} (en) [Group {i % 7}]")
+        elif kind == 1:
+            names.append(f"Ch.{chapter:04d}.{i % 3} (en) [Group {i % 7}]")
+        elif kind == 2:
+            names.append(f"Chapter {chapter}_ Another Title {i}.cbz")
+        else:
+            names.append(f"MANGA Plus_#{chapter:03d} - Chapter {chapter}_ Plus Title.cbz" if i % 8 else "MANGA Plus_#ex.cbz")
+
+    start = time.perf_counter()
+    records = parse_names(names)
+    elapsed = time.perf_counter() - start
+
+    unparsed = sum(record is None for record in records)
+    print(f"Parsed {count} names in {elapsed:.3f}s ({count / elapsed:,.0f} names/s, {unparsed} unparsed)")
+
+if __name__ == "__main__":
+    benchmark()
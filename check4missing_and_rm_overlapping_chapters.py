@@ -1,28 +1,80 @@
 import os
 import shutil
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from statistics import median
+from PIL import Image
+from chapter_names import parse_name, chapter_number
+from library_catalog import get_catalog
+import metrics
+
+# How much each part of the quality score counts, relative to the best candidate
+score_weights = {"pages": 0.5, "resolution": 0.35, "bytes_per_pixel": 0.15}
 
 def get_subdirs(base_dir):
-    return [d for d in os.listdir(base_dir) if os.path.isdir(os.path.join(base_dir, d))]
+    catalog = get_catalog()
+    with metrics.timer("scan"):
+        catalog.refresh_series(base_dir)
+    return [chapter["name"] for chapter in catalog.chapters(base_dir) if chapter["kind"] == "folder"]
 
 def parse_folder_name(name):
-    parts = name.split()
-    if len(parts) < 3:
-        return None, None  # Ignore folders that don't fit the pattern
-    key = " ".join(parts[:2])  # "Vol.XX Ch.XXXXX"
-    translator = None
-    if "[" in name and "]" in name:
-        translator = name[name.rfind("[") + 1:name.rfind("]")]
-    return key, translator
+    """
+    (volume, chapter, part) and translator of a chapter folder. Folders that
+    don't fit the pattern, or have no chapter number, get key None and are
+    never grouped or deleted.
+    """
+    record = parse_name(name)
+    if record is None or record.chapter is None:
+        return None, None
+    return (record.volume, record.chapter, record.part), record.translator
 
 def extract_chapter_number(name):
-    parts = name.split()
-    if len(parts) >= 3 and parts[1].startswith("Ch."):
+    record = parse_name(name)
+    return chapter_number(record) if record is not None else None
+
+def get_folder_stats(pages):
+    """
+    Page count, median resolution and bytes per pixel of a chapter folder,
+    given its page rows from the library catalog.
+    Only image headers are read, pixels are never decoded.
+    Files that aren't images don't count as pages.
+    """
+    sizes = []
+    total_bytes = 0
+    total_pixels = 0
+    for page in pages:
         try:
-            return float(parts[1][3:])  # Handle both integers and decimals
-        except ValueError:
-            return None
-    return None
+            with metrics.timer("open"), Image.open(page["path"]) as img:
+                width, height = img.size
+        except Exception:
+            continue
+        sizes.append((width, height))
+        total_bytes += page["size"]
+        total_pixels += width * height
+
+    pixels = median(w * h for w, h in sizes) if sizes else 0
+    width, height = min(sizes, key=lambda size: abs(size[0] * size[1] - pixels)) if sizes else (0, 0)
+    return {
+        "pages": len(sizes),
+        "resolution": pixels,
+        "size": f"{width}x{height}",
+        "bytes_per_pixel": total_bytes / total_pixels if total_pixels else 0,
+    }
+
+def score_candidates(stats):
+    """
+    Scores each candidate's stats against the best value in its group.
+    Returns a list of scores in the same order.
+    """
+    best = {name: max(s[name] for s in stats) or 1 for name in score_weights}
+    return [
+        sum(weight * s[name] / best[name] for name, weight in score_weights.items())
+        for s in stats
+    ]
+
+def describe(stats, score):
+    return "score {:.2f}: {} pages, median {}, {:.2f} bytes/pixel".format(
+        score, stats["pages"], stats["size"], stats["bytes_per_pixel"])
 
 def main():
     base_dir = os.path.dirname(os.path.abspath(__file__))
@@ -39,26 +91,36 @@ def main():
         if chapter_num is not None:
             chapter_numbers.add(chapter_num)
         if key:
-            folder_path = os.path.join(base_dir, folder)
-            file_count = len(os.listdir(folder_path))
-            chapter_groups[key].append((folder, file_count, translator))
+            chapter_groups[key].append((folder, translator))
+    
+    # Read page headers of every duplicate candidate in parallel
+    candidates = [folder for folders in chapter_groups.values() if len(folders) > 1 for folder, _ in folders]
+    catalog = get_catalog()
+    candidate_pages = [catalog.pages(os.path.join(base_dir, folder)) for folder in candidates]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        folder_stats = dict(zip(candidates, executor.map(get_folder_stats, candidate_pages)))
     
     for key, folders in chapter_groups.items():
         if len(folders) > 1:
-            # Sort folders by file count (descending), then name (to keep a consistent result)
-            folders.sort(key=lambda x: (-x[1], x[0]))
+            stats = [folder_stats[folder] for folder, _ in folders]
+            scores = score_candidates(stats)
+            
+            # Sort folders by quality score (descending), then name (to keep a consistent result)
+            ranked = sorted(zip(folders, stats, scores), key=lambda x: (-x[2], x[0][0]))
             
-            # Keep the one with the most files, remove the rest
-            kept_folder, kept_file_count, kept_translator = folders[0]
+            # Keep the best one, remove the rest
+            (kept_folder, kept_translator), kept_stats, kept_score = ranked[0]
             kept_chapters[key] = kept_translator
+            print(f"Keeping {kept_folder} ({describe(kept_stats, kept_score)})")
             
-            for folder, file_count, translator in folders[1:]:
-                delete_reason = "has less pages ({} < {})".format(file_count, kept_file_count)
+            for (folder, translator), folder_stat, score in ranked[1:]:
+                delete_reason = "it scores lower ({} vs kept {})".format(
+                    describe(folder_stat, score), describe(kept_stats, kept_score))
                 
                 # If overlapping chapter numbers, check translator consistency
                 if extract_chapter_number(folder) is not None:
-                    base_chapter = int(extract_chapter_number(folder))
-                    if base_chapter in kept_chapters and kept_chapters[base_chapter] != translator:
+                    base_key = (key[0], int(extract_chapter_number(folder)), 0)
+                    if base_key in kept_chapters and kept_chapters[base_key] != translator:
                         delete_reason = "it has a different translator than previously kept chapter ({})".format(translator)
                 
                 folder_path = os.path.join(base_dir, folder)
@@ -93,4 +155,10 @@ def main():
             print(log)
 
 if __name__ == "__main__":
-    main()
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Delete lower quality duplicate chapters next to this script and list missing chapter numbers')
+    metrics.add_arguments(parser)
+
+    args = parser.parse_args()
+    metrics.run(main, args)
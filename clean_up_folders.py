@@ -1,44 +1,136 @@
 import os
-import shutil
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
+from library_catalog import get_catalog
+import metrics
 
 # Get the directory where the script is located
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
-def can_open_image(file_path):
-    """Check if a file can be opened as an image."""
+# Leading bytes of the image formats pages come in, as (offset, bytes) parts that must all match
+image_signatures = [
+    ((0, b"\xff\xd8\xff"),),                   # JPEG
+    ((0, b"\x89PNG\r\n\x1a\n"),),             # PNG
+    ((0, b"GIF87a"),),                         # GIF
+    ((0, b"GIF89a"),),
+    ((0, b"RIFF"), (8, b"WEBP")),              # WebP
+    ((0, b"BM"),),                             # BMP
+    ((0, b"II*\x00"),),                        # TIFF
+    ((0, b"MM\x00*"),),
+]
+
+def has_image_signature(header):
+    return any(
+        all(header[offset:offset + len(magic)] == magic for offset, magic in signature)
+        for signature in image_signatures
+    )
+
+def check_image(file_path, deep=False):
+    """
+    Checks if a file is an image: its first bytes must match an image format
+    and Pillow must be able to parse its header. With deep=True it's also
+    verified and fully decoded.
+    """
     try:
+        with open(file_path, 'rb') as f:
+            if not has_image_signature(f.read(16)):
+                return False
         with Image.open(file_path) as img:
-            img.verify()  # Verify the image without fully loading it
+            if deep:
+                img.verify()  # Checks the file structure, the image can't be used afterwards
+        if deep:
+            with Image.open(file_path) as img:
+                img.load()
         return True
     except Exception:
         return False
 
-# Iterate through all subdirectories
-for folder in os.listdir(script_dir):
-    folder_path = os.path.join(script_dir, folder)
-
-    if os.path.isdir(folder_path):  # Check if it's a folder
-        # Iterate over all files in the folder
-        for root, _, files in os.walk(folder_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                
-                # Check if the file is an actual image
-                if not can_open_image(file_path):
-                    try:
+def check_files(executor, paths, deep):
+    """
+    Returns {path: is image} for the files in paths. Files whose size and
+    mtime didn't change since an earlier run keep their cached verdict.
+    """
+    catalog = get_catalog()
+    stats = {path: os.stat(path) for path in paths}
+    cached = catalog.file_checks(paths)
+
+    verdicts = {}
+    unchecked = []
+    for path, stat in stats.items():
+        entry = cached.get(path)
+        # A deep verdict is good for a quick check too, not the other way round
+        if entry and entry[:2] == (stat.st_size, stat.st_mtime_ns) and (entry[2] or not deep):
+            verdicts[path] = entry[3]
+        else:
+            unchecked.append(path)
+
+    def timed_check(path):
+        with metrics.timer("verify"):
+            return check_image(path, deep)
+
+    results = list(executor.map(timed_check, unchecked))
+    for path, is_image in zip(unchecked, results):
+        metrics.add_bytes("verify", stats[path].st_size)
+        verdicts[path] = is_image
+    catalog.store_file_checks(
+        (path, stats[path].st_size, stats[path].st_mtime_ns, deep, is_image)
+        for path, is_image in zip(unchecked, results)
+    )
+    return verdicts
+
+def clean_up_folder(executor, folder_path, deep=False):
+    """
+    Deletes the files in folder_path that aren't images and the folders left
+    empty, in one bottom-up walk. folder_path itself is kept.
+    """
+    removed_dirs = set()
+    deleted = []
+
+    for root, dirs, files in os.walk(folder_path, topdown=False):
+        verdicts = check_files(executor, [os.path.join(root, file) for file in files], deep)
+        remaining = len(files)
+
+        for file_path, is_image in verdicts.items():
+            if not is_image:
+                try:
+                    with metrics.timer("remove"):
                         os.remove(file_path)  # Delete the file
-                        print(f"Deleted: {file_path}")
-                    except Exception as e:
-                        print(f"Error deleting {file_path}: {e}")
-
-        # Remove empty directories
-        for root, dirs, _ in os.walk(folder_path, topdown=False):
-            for dir_name in dirs:
-                dir_path = os.path.join(root, dir_name)
-                if not os.listdir(dir_path):  # If empty
-                    try:
-                        os.rmdir(dir_path)  # Remove empty folder
-                        print(f"Removed empty folder: {dir_path}")
-                    except Exception as e:
-                        print(f"Error removing {dir_path}: {e}")
+                    deleted.append(file_path)
+                    remaining -= 1
+                    print(f"Deleted: {file_path}")
+                except Exception as e:
+                    print(f"Error deleting {file_path}: {e}")
+
+        # Subfolders were walked first, so it's known here whether this one is empty
+        if root != folder_path and not remaining and all(os.path.join(root, d) in removed_dirs for d in dirs):
+            try:
+                os.rmdir(root)  # Remove empty folder
+                removed_dirs.add(root)
+                print(f"Removed empty folder: {root}")
+            except Exception as e:
+                print(f"Error removing {root}: {e}")
+
+    get_catalog().forget_files(deleted)
+
+def clean_up(directory, deep=False, jobs=8):
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        # Iterate through all subdirectories
+        for folder in os.listdir(directory):
+            folder_path = os.path.join(directory, folder)
+
+            if os.path.isdir(folder_path):  # Check if it's a folder
+                clean_up_folder(executor, folder_path, deep)
+                get_catalog().commit()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Delete files that are not images and empty folders next to this script')
+    parser.add_argument('--deep', action='store_true',
+                        help='Also verify and fully decode every image, not just its header')
+    parser.add_argument('--jobs', type=int, default=8,
+                        help='Number of files checked at the same time (default: 8)')
+    metrics.add_arguments(parser)
+
+    args = parser.parse_args()
+    metrics.run(clean_up, args, script_dir, args.deep, args.jobs)
@@ -0,0 +1,87 @@
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import metrics
+
+# Finds translator credit / recruitment pages: near-identical pages at the
+# start or end of many chapters by the same translator.
+
+hash_size = 8
+
+def dhash(image_path):
+    """
+    64-bit difference hash of a page. JPEGs are decoded at reduced scale
+    since only a 9x8 grayscale version is needed.
+    """
+    with metrics.timer("decode"), Image.open(image_path) as img:
+        img.draft('L', (hash_size * 16, hash_size * 16))
+        small = np.asarray(img.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    metrics.add_bytes("decode", os.path.getsize(image_path))
+
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+def hamming_distances(hashes, value):
+    xor = np.bitwise_xor(hashes, np.uint64(value))
+    return np.unpackbits(xor.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+
+def cluster_pages(pages, max_distance):
+    """
+    Groups (chapter, path, hash) pages whose hashes are within max_distance
+    bits of a cluster's first page. Returns a list of clusters.
+    """
+    clusters = []
+    representatives = np.zeros(0, dtype=np.uint64)
+
+    for chapter, path, value in pages:
+        if representatives.size:
+            distances = hamming_distances(representatives, value)
+            nearest = int(distances.argmin())
+            if distances[nearest] <= max_distance:
+                clusters[nearest].append((chapter, path))
+                continue
+        clusters.append([(chapter, path)])
+        representatives = np.append(representatives, np.uint64(value))
+
+    return clusters
+
+def find_repeated_pages(chapters, min_share=0.25, min_chapters=3, max_distance=6, jobs=8):
+    """
+    Takes {translator: [(chapter_path, page names)]} as built by
+    remove_translator_pages.get_chapters and returns the set of page paths
+    whose cluster spans enough of that translator's chapters.
+    """
+    flagged = set()
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for translator, translator_chapters in chapters.items():
+            paths = [
+                (chapter_path, os.path.join(chapter_path, image))
+                for chapter_path, images in translator_chapters
+                for image in dict.fromkeys(images) if image is not None
+            ]
+            hashes = executor.map(safe_dhash, [path for _, path in paths])
+
+            # Flat pages (blank or single color) have no gradient to compare
+            pages = [(chapter, path, value) for (chapter, path), value in zip(paths, hashes) if value]
+
+            needed = max(min_chapters, int(len(translator_chapters) * min_share))
+            with metrics.timer("detect"):
+                repeated = [
+                    path for cluster in cluster_pages(pages, max_distance)
+                    if len({chapter for chapter, _ in cluster}) >= needed
+                    for _, path in cluster
+                ]
+            flagged.update(repeated)
+
+            print(f"{translator}: {len(pages)} pages hashed, {len(repeated)} repeated pages")
+
+    return flagged
+
+def safe_dhash(image_path):
+    try:
+        return dhash(image_path)
+    except Exception as e:
+        print(f"Error hashing {image_path}: {e}")
+        return 0
@@ -0,0 +1,227 @@
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from library_catalog import get_catalog
+from run_manifest import Manifest, file_hash
+import metrics
+
+# Replaces identical pages in manga/ (covers placed as 000.jpg, recurring
+# credit pages, overlapping uploads) with hardlinks to a single copy.
+# Only pages whose size is shared with another file are read; their hashes
+# are kept in library.db by size and mtime, so a rerun only reads new pages.
+
+manga_dir = "./manga"
+
+page_extensions = ('.jpg', '.jpeg', '.png', '.webp')
+
+def scan_pages(root):
+    """{absolute path: stat} of every page below root."""
+    pages = {}
+    for folder, _, files in os.walk(root):
+        for file in files:
+            if file.lower().endswith(page_extensions):
+                path = os.path.abspath(os.path.join(folder, file))
+                pages[path] = os.stat(path)
+    return pages
+
+def link_duplicate(keeper, path):
+    """Replaces path with a hardlink to keeper. path never goes missing in between."""
+    temp_path = path + ".dedupe"
+    if os.path.lexists(temp_path):
+        os.remove(temp_path)
+    os.link(keeper, temp_path)
+    os.replace(temp_path, path)
+
+def hash_pages(executor, pages):
+    """
+    Returns {path: hash} for pages ({path: stat}). Pages whose size and
+    mtime didn't change since an earlier run keep their stored hash.
+    """
+    catalog = get_catalog()
+    cached = catalog.page_hashes(pages)
+
+    hashes = {}
+    unhashed = []
+    for path, stat in pages.items():
+        entry = cached.get(path)
+        if entry and entry[:2] == (stat.st_size, stat.st_mtime_ns):
+            hashes[path] = entry[2]
+        else:
+            unhashed.append(path)
+
+    def timed_hash(path):
+        # Read in chunks, pages are never loaded whole
+        with metrics.timer("hash"):
+            return file_hash(path)
+
+    for path, value in zip(unhashed, executor.map(timed_hash, unhashed)):
+        metrics.add_bytes("hash", pages[path].st_size)
+        hashes[path] = value
+    catalog.store_page_hashes((path, pages[path].st_size, pages[path].st_mtime_ns, hashes[path]) for path in unhashed)
+    return hashes
+
+def series_manifest(manifests, root, path):
+    """The manga/ manifest of the series path belongs to, loaded once."""
+    series = os.path.relpath(path, os.path.abspath(root)).split(os.sep)[0]
+    if series not in manifests:
+        manifests[series] = Manifest(os.path.join(root, series, ".manifest.json"))
+    return manifests[series]
+
+def dedupe(root=manga_dir, jobs=8, dry_run=False):
+    catalog = get_catalog()
+    with metrics.timer("scan"):
+        pages = scan_pages(root)
+    catalog.forget_page_hashes([row["path"] for row in catalog.hashes_below(root) if row["path"] not in pages])
+
+    by_size = defaultdict(list)
+    for path, stat in pages.items():
+        by_size[stat.st_size].append(path)
+    # A page can only have a copy if another file (not just another link) has its size
+    candidates = {
+        path: pages[path] for paths in by_size.values()
+        if len({(pages[p].st_dev, pages[p].st_ino) for p in paths}) > 1
+        for path in paths
+    }
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        hashes = hash_pages(executor, candidates)
+
+    groups = defaultdict(list)
+    for path in sorted(hashes):
+        groups[(candidates[path].st_size, hashes[path])].append(path)
+
+    linked = reclaimed = failed = 0
+    manifests = {}
+    relinked = []
+    for (size, value), paths in groups.items():
+        inodes = defaultdict(list)
+        for path in paths:
+            inodes[(pages[path].st_dev, pages[path].st_ino)].append(path)
+        if len(inodes) < 2:
+            continue
+
+        # Keep the copy that is linked most already
+        keeper_inode = max(inodes, key=lambda inode: len(inodes[inode]))
+        keeper = inodes[keeper_inode][0]
+        for inode, duplicates in inodes.items():
+            if inode == keeper_inode or inode[0] != keeper_inode[0]:
+                # Hardlinks can't cross filesystems
+                continue
+            inode_failed = False
+            for path in duplicates:
+                if not dry_run:
+                    try:
+                        with metrics.timer("link"):
+                            link_duplicate(keeper, path)
+                    except OSError as e:
+                        print(f"Error linking {path}: {e}")
+                        failed += 1
+                        inode_failed = True
+                        continue
+                    relinked.append((path, value))
+                linked += 1
+                print(f"{'Would link' if dry_run else 'Linked'} {path} -> {keeper}")
+            # The bytes are only freed once no other link is left
+            if not inode_failed and pages[duplicates[0]].st_nlink == len(duplicates):
+                reclaimed += size
+
+    stored = []
+    for path, value in relinked:
+        stat = os.stat(path)
+        stored.append((path, stat.st_size, stat.st_mtime_ns, value))
+        # The page now has the mtime of the copy it links to, its bytes are the same
+        series_manifest(manifests, root, path).restat(path)
+    catalog.store_page_hashes(stored)
+    catalog.commit()
+    for manifest in manifests.values():
+        if os.path.exists(manifest.path):
+            manifest.save()
+
+    print(f"{len(pages)} pages, {len(candidates)} with a size shared by another file, "
+          f"{linked} duplicates {'found' if dry_run else 'linked'}, "
+          f"{reclaimed / 1024 / 1024:.1f} MB {'to reclaim' if dry_run else 'reclaimed'}"
+          + (f", {failed} could not be linked" if failed else ""))
+    return reclaimed
+
+class LinkIndex:
+    """
+    Links pages to an identical page in manga/ as last_step places them.
+    Starts from the hashes stored by dedupe_pages and earlier runs;
+    can be used from several threads, store() from the catalog's thread.
+    """
+    def __init__(self, root=manga_dir):
+        self.keepers = {}
+        self.placed = []
+        self.linked = 0
+        self.reclaimed = 0
+        self.lock = threading.Lock()
+        for row in get_catalog().hashes_below(root):
+            self.keepers.setdefault((row["size"], row["hash"]), (row["path"], row["mtime"]))
+
+    def keeper(self, path, size, content_hash, mtime):
+        """Path of the first page with this content that is still unchanged, path itself if there is none."""
+        key = (size, content_hash)
+        with self.lock:
+            keeper, keeper_mtime = self.keepers.setdefault(key, (path, mtime))
+        if keeper == path:
+            return path
+        try:
+            stat = os.stat(keeper)
+            if (stat.st_size, stat.st_mtime_ns) == (size, keeper_mtime):
+                return keeper
+        except FileNotFoundError:
+            pass
+        # Gone or changed since it was hashed, this page takes its place
+        with self.lock:
+            self.keepers[key] = (path, mtime)
+        return path
+
+    def link(self, path, content_hash):
+        """
+        Replaces the page at path with a hardlink to an identical page placed
+        before, if there is one. content_hash is its file_hash. Returns True if it was linked.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        keeper = self.keeper(path, stat.st_size, content_hash, stat.st_mtime_ns)
+
+        linked = False
+        if keeper != path and not os.path.samefile(keeper, path):
+            try:
+                with metrics.timer("link"):
+                    link_duplicate(keeper, path)
+                linked = True
+            except OSError as e:
+                # No hardlinks on this filesystem, the page stays a copy
+                print(f"Error linking {path}: {e}")
+
+        mtime = os.stat(path).st_mtime_ns
+        with self.lock:
+            self.placed.append((path, stat.st_size, mtime, content_hash))
+            if linked:
+                self.linked += 1
+                # The bytes are only freed if nothing else linked to the replaced copy
+                self.reclaimed += stat.st_size if stat.st_nlink == 1 else 0
+        return linked
+
+    def store(self):
+        """Saves the hashes of the pages placed so far to library.db."""
+        with self.lock:
+            placed, self.placed = self.placed, []
+        catalog = get_catalog()
+        catalog.store_page_hashes(placed)
+        catalog.commit()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Replace identical pages in manga/ with hardlinks to one copy')
+    parser.add_argument('root', nargs='?', default=manga_dir, help='Folder to deduplicate (default: ./manga)')
+    parser.add_argument('--jobs', type=int, default=8,
+                        help='Number of pages hashed at the same time (default: 8)')
+    parser.add_argument('--dry-run', action='store_true', help='Only list the duplicates')
+    metrics.add_arguments(parser)
+
+    args = parser.parse_args()
+    metrics.run(dedupe, args, args.root, args.jobs, args.dry_run)
@@ -1,6 +1,32 @@
+import io
 import os
+import re
 import shutil
-from PIL import Image, ImageOps, ImageChops
+import zipfile
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+import border_crop
+import page_encoder
+from page_encoder import PageEncoder
+from strips import open_image
+from library_catalog import get_catalog
+from run_manifest import Manifest
+import metrics
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory isn't reported there
+    resource = None
+
+# How many pages were copied as-is, re-encoded, saved gray or skipped as up to date,
+# and the bytes of their sources and outputs
+page_stats = Counter()
+
+# Recorded with every output page (with the encoder settings), change it when the processing changes
+process_params = "crop=edge"
 
 def get_user_input(prompt, allowed_values=None):
     while True:
@@ -10,33 +36,20 @@ def get_user_input(prompt, allowed_values=None):
         print("Invalid input. Please try again.")
 
 def crop_borders(img):
-    # Detect border color dynamically
-    img = img.convert('RGB')
-    border_color = get_border_color(img)
-    
-    # Create a background with the detected border color
-    bg = Image.new(img.mode, img.size, border_color)
-
-    # Find bounding box where the image differs from the border color
-    diff = ImageChops.difference(img, bg)
-    bbox = diff.getbbox()
-    # Crop or return the original image
-    cropped_img = img.crop(bbox)
-    return cropped_img, border_color
-
-def get_border_color(img):
-    # Ensure the image is in RGB mode
-
-    width, height = img.size
-    top_border = img.crop((0, 0, width, 1)).getdata()
-    bottom_border = img.crop((0, height - 1, width, height)).getdata()
-    left_border = img.crop((0, 0, 1, height)).getdata()
-    right_border = img.crop((width - 1, 0, width, height)).getdata()
+    # Detect border color dynamically and crop everything that matches it
+    return border_crop.crop(img, 'edge')
 
-    # Combine all border pixels and find the most common color
-    border_pixels = list(top_border) + list(bottom_border) + list(left_border) + list(right_border)
-    most_common_color = max(set(border_pixels), key=border_pixels.count)
-    return most_common_color
+def copy_source(source, output_file):
+    # Copy the original page bytes, from a path or an archive member
+    def write(temp_path):
+        if isinstance(source, str):
+            shutil.copyfile(source, temp_path)
+        else:
+            source.seek(0)
+            with open(temp_path, 'wb') as f:
+                shutil.copyfileobj(source, f)
+    # Replaced, not rewritten: manga/ pages can be hardlinks to this file
+    page_encoder.replace_file(output_file, write)
 
 def adjust_ratio(img, target_ratio, border_color):
     target_width, target_height = target_ratio
@@ -56,42 +69,253 @@ def adjust_ratio(img, target_ratio, border_color):
 
     return new_img
 
-def process_chapter(input_dir, output_dir, chapter_name, volume_name, page_start, target_ratio):
+page_extensions = ('.png', '.jpg', '.jpeg')
+
+def get_chapter_sources(directory, prefix=""):
+    """
+    Maps chapter names (optionally only those starting with prefix) to their
+    source: a folder or a .cbz archive, looked up in the library catalog.
+    A folder wins over an archive with the same name (it was already unpacked).
+    """
+    catalog = get_catalog()
+    if catalog.series_id(directory) is None:
+        catalog.refresh_series(directory)
+
+    sources = {}
+    for chapter in catalog.chapters(directory, prefix):
+        if chapter["kind"] == "folder":
+            sources[chapter["name"]] = chapter["path"]
+        else:
+            sources.setdefault(chapter["name"], chapter["path"])
+    return sources
+
+def source_size(source):
+    # Size of a page file, or of an archive member read so far
+    if isinstance(source, str):
+        return os.path.getsize(source)
+    return source.seek(0, io.SEEK_END)
+
+def iter_page_sources(part_path):
+    """
+    Yields (name, source, checksum) for every page of a chapter folder or
+    .cbz archive. Archive pages are the open zip members, read by the caller
+    (nothing is unpacked to disk); their checksum comes from the zip
+    directory. Folder pages have no checksum (None).
+    """
+    if os.path.isdir(part_path):
+        for file in sorted(os.listdir(part_path)):
+            if file.lower().endswith(page_extensions):
+                img_path = os.path.join(part_path, file)
+                yield img_path, img_path, None
+        return
+
+    try:
+        with zipfile.ZipFile(part_path) as cbz_file:
+            members = sorted(
+                (info for info in cbz_file.infolist()
+                 if not info.is_dir() and info.filename.lower().endswith(page_extensions)),
+                key=lambda info: info.filename
+            )
+            for info in members:
+                with cbz_file.open(info) as page:
+                    yield os.path.join(part_path, info.filename), page, f"crc32:{info.CRC:08x}:{info.file_size}"
+    except (ValueError, zipfile.BadZipFile) as e:
+        print(f"Error reading archive {part_path}: {e}")
+
+class PagePool:
+    """
+    Worker threads for pages. Pillow and numpy release the GIL while decoding,
+    comparing and encoding, so pages of a chapter are worked on side by side.
+    Submitting blocks while the decoded pages in flight would go over
+    memory_budget bytes (one page is always let through, however big).
+    """
+    def __init__(self, jobs=1, memory_budget=512 * 1024 * 1024):
+        self.jobs = jobs
+        self.executor = ThreadPoolExecutor(max_workers=jobs)
+        self.memory_budget = memory_budget
+        self.in_flight = 0
+        self.peak = 0
+        self.condition = threading.Condition()
+
+    def submit(self, size, function, *args):
+        with self.condition:
+            while self.in_flight and self.in_flight + size > self.memory_budget:
+                self.condition.wait()
+            self.in_flight += size
+            self.peak = max(self.peak, self.in_flight)
+        future = self.executor.submit(function, *args)
+        future.add_done_callback(lambda _: self.release(size))
+        return future
+
+    def reset_peak(self):
+        """Starts measuring peak from what is in flight now."""
+        with self.condition:
+            self.peak = self.in_flight
+
+    def release(self, size):
+        with self.condition:
+            self.in_flight -= size
+            self.condition.notify_all()
+
+    def close(self):
+        self.executor.shutdown()
+
+def page_memory(img):
+    # Decoded page plus its cropped RGB copy, from the header alone
+    width, height = img.size
+    return width * height * (len(img.getbands()) + 3)
+
+def process_page(img, source, output_file, encoder):
+    """
+    Crops one opened (not yet decoded) page into output_file and closes it.
+    Returns ("copied" if the source was kept as-is, "encoded" otherwise,
+    the mode saved, source bytes, output bytes).
+    """
+    with metrics.timer("prepare"), img:
+        with metrics.timer("decode"):
+            img.load()
+        source_bytes = source_size(source)
+        metrics.add_bytes("decode", source_bytes)
+        original_size = img.size
+        with metrics.timer("detect"):
+            cropped, border_color = crop_borders(img)
+            mode = encoder.output_mode(cropped)
+        # cropped = adjust_ratio(cropped, target_ratio, border_color)
+
+        if cropped.size == original_size and encoder.keeps_source(img, mode):
+            # Nothing to crop or convert, keep the original JPEG untouched
+            with metrics.timer("copy"):
+                copy_source(source, output_file)
+            metrics.add_bytes("copy", os.path.getsize(output_file))
+            return 'copied', img.mode, source_bytes, source_bytes
+
+        with metrics.timer("save"):
+            encoder.save(cropped, output_file, img, mode)
+        output_bytes = os.path.getsize(output_file)
+        metrics.add_bytes("save", output_bytes)
+        return 'encoded', mode, source_bytes, output_bytes
+
+def process_chapter(input_dir, output_dir, chapter_name, volume_name, page_start, target_ratio, manifest=None, pool=None, encoder=None,
+                    sources=None, outputs=None):
+    """
+    sources maps the chapter's parts to their folder or archive, looked up in the
+    catalog if not given. outputs, if given, gets the number and path of every
+    page made or kept up to date. Pages that fail leave no gap in the numbering.
+    Returns the number after the last page.
+    """
     chapter_path = os.path.join(output_dir, volume_name, chapter_name)
     os.makedirs(chapter_path, exist_ok=True)
     adjust_ratio_bool = bool
-    chapter_parts = sorted([d for d in os.listdir(input_dir) if d.startswith(chapter_name)])
+    if sources is None:
+        sources = get_chapter_sources(input_dir, chapter_name)
+    chapter_parts = sorted(sources)
     page_number = page_start
+    own_pool = pool is None
+    pool = pool or PagePool()
+    encoder = encoder or PageEncoder()
+    params = f"{process_params};{encoder.params}"
+    pending = deque()
+    # Number -> output file of every page made or kept, numbered as submitted
+    produced = {}
 
-    for part in chapter_parts:
-        part_path = os.path.join(input_dir, part)
-        if not os.path.isdir(part_path):
-            continue
+    def finish(future, img_path, output_file, source_hash, number):
+        # Results are handled in page order, on this thread
+        try:
+            status, mode, source_bytes, output_bytes = future.result()
+        except Exception as e:
+            print(f"Error processing {img_path}: {e}")
+            return
+        page_stats[status] += 1
+        page_stats['gray'] += status == 'encoded' and mode == 'L'
+        page_stats['source_bytes'] += source_bytes
+        page_stats['output_bytes'] += output_bytes
+        if manifest is not None:
+            manifest.record(output_file, source_hash, params)
+        produced[number] = output_file
+        print(f"Processed {volume_name} {chapter_name[:7]} Page {number}")
 
-        for file in sorted(os.listdir(part_path)):
-            if not file.lower().endswith(('.png', '.jpg', '.jpeg')):
-                continue
-
-            img_path = os.path.join(part_path, file)
-            
+    for part in chapter_parts:
+        for img_path, source, checksum in iter_page_sources(sources[part]):
+            output_file = os.path.join(chapter_path, f"{str(page_number).zfill(3)}{encoder.extension}")
             try:
-                img = Image.open(img_path)
-                img, border_color = crop_borders(img)
-                # img = adjust_ratio(img, target_ratio, border_color)
+                source_hash = None
+                if manifest is not None:
+                    source_hash = checksum or manifest.source_hash(img_path)
+                    if manifest.is_fresh(output_file, source_hash, params):
+                        page_stats['skipped'] += 1
+                        produced[page_number] = output_file
+                        page_number += 1
+                        continue
 
-                output_file = os.path.join(chapter_path, f"{str(page_number).zfill(3)}.jpg")
-                img.save(output_file)
-                print(f"Processed {volume_name} {chapter_name[0]}{chapter_name[1]}{chapter_name[2]}{chapter_name[3]}{chapter_name[4]}{chapter_name[5]}{chapter_name[6]} Page {page_number}")
+                if not isinstance(source, str):
+                    # Archive members can't be read once the archive moved on
+                    source = io.BytesIO(source.read())
+                # Only the header is read here, the worker decodes the page
+                img = open_image(source)
+                pending.append((pool.submit(page_memory(img), process_page, img, source, output_file, encoder),
+                                img_path, output_file, source_hash, page_number))
                 page_number += 1
                 
             except Exception as e:
                 print(f"Error processing {img_path}: {e}")
 
-    return page_number
+            # Don't open pages much faster than the workers get through them
+            while pending and (pending[0][0].done() or len(pending) > pool.jobs * 2):
+                finish(*pending.popleft())
+
+    while pending:
+        finish(*pending.popleft())
+    if own_pool:
+        pool.close()
+
+    # A page that failed in a worker got a number already, move the pages after it up
+    for final, number in enumerate(sorted(produced), page_start):
+        if final != number:
+            final_file = os.path.join(chapter_path, f"{str(final).zfill(3)}{encoder.extension}")
+            os.replace(produced[number], final_file)
+            if manifest is not None:
+                manifest.move(produced[number], final_file)
+            produced[number] = final_file
+    if outputs is not None:
+        outputs.update(enumerate((produced[number] for number in sorted(produced)), page_start))
+
+    return page_start + len(produced)
 
-def assign_volumes(chapters):
+def load_volume_map(path):
+    """
+    Reads a volume map file. Each line is either a chapter range and its volume
+    ("1-9: 1", "10: 2") or the start of the unassigned volume ("X from 120").
+    Lines starting with # are comments.
+    """
+    volume_map = {"ranges": [], "x_from": None}
+    if not os.path.exists(path):
+        return volume_map
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#")[0].strip()
+            if not line:
+                continue
+            x_from = re.fullmatch(r"X\s+from\s+(\d+)", line, re.IGNORECASE)
+            chapter_range = re.fullmatch(r"(\d+)(?:\s*-\s*(\d+))?\s*:\s*(\d+|X)", line, re.IGNORECASE)
+            if x_from:
+                volume_map["x_from"] = int(x_from.group(1))
+            elif chapter_range:
+                start, end, volume = chapter_range.groups()
+                volume_map["ranges"].append((int(start), int(end or start), volume.upper()))
+            else:
+                print(f"Ignoring invalid line in {path}: {line}")
+    return volume_map
+
+def assign_volumes(chapters, volume_map=None, batch=False):
+    """
+    Maps chapters to volume folders. Volumes come from the chapter name first,
+    then from the volume map, then from the "Vol.X from chapter N" rule.
+    Remaining chapters are asked for, or left out in batch mode.
+    """
     volume_assignments = {}
     unassigned_volume_start = None
+    volume_map = volume_map or {"ranges": [], "x_from": None}
 
     # Function to detect and return the volume format
     def detect_volume_format(chapters):
@@ -109,8 +333,10 @@ def assign_volumes(chapters):
                         raise ValueError("Volume number format is inconsistent.")
         return volume_format or 1  # Default to no leading zeros if not found
 
-    # Step 1: Ask when unassigned chapters start
-    while True:
+    # Step 1: Ask when unassigned chapters start, unless the volume map says
+    if volume_map["x_from"] is not None:
+        unassigned_volume_start = volume_map["x_from"]
+    while unassigned_volume_start is None and not batch:
         unassigned_start = get_user_input("Enter chapter number where unassigned volume starts (e.g., 123): ")
         if unassigned_start.isdigit():
             unassigned_volume_start = int(unassigned_start)
@@ -128,14 +354,18 @@ def assign_volumes(chapters):
             # Extract chapter number, ignoring decimals
             try:
                 chapter_number = int(chapter.split("Ch.")[1].split()[0].split('.')[0])
-                if chapter_number >= unassigned_volume_start:
+                mapped = [volume for start, end, volume in volume_map["ranges"] if start <= chapter_number <= end]
+                if mapped:
+                    volume = mapped[0]
+                    volume_assignments[chapter] = f"Vol.{volume if volume == 'X' else volume.zfill(volume_format)}"
+                elif unassigned_volume_start is not None and chapter_number >= unassigned_volume_start:
                     volume_assignments[chapter] = f"Vol.X"  # Assign default value for unassigned
-            except ValueError:
+            except (IndexError, ValueError):
                 print(f"Skipping invalid chapter format: {chapter}")
 
     # Step 3: Prompt user to assign missing chapters
     for chapter in chapters:
-        if chapter not in volume_assignments:
+        if chapter not in volume_assignments and not batch:
             while True:
                 vol = get_user_input(f"Assign volume for chapter {chapter} (e.g., 1, 2, etc.): ")
                 if vol.isdigit():
@@ -147,23 +377,60 @@ def assign_volumes(chapters):
     return volume_assignments
 
 
-def process_series(series_name, input_dir, output_dir, target_ratio):
+def bytes_saved(stats):
+    saved = stats['source_bytes'] - stats['output_bytes']
+    share = saved / stats['source_bytes'] * 100 if stats['source_bytes'] else 0
+    return (f"{stats['gray']} pages re-encoded gray, {saved / 1024 / 1024:.1f} MB saved "
+            f"({share:.0f}% of {stats['source_bytes'] / 1024 / 1024:.1f} MB)")
+
+def peak_memory_mb():
+    if resource is None:
+        return None
+    return metrics.maxrss_mb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+def process_series(series_name, input_dir, output_dir, target_ratio, volume_map=None, batch=False, pool=None, encoder=None):
+    """
+    Processes every chapter of a series that has a volume.
+    Returns the chapters left without a volume (only possible in batch mode).
+    """
     print(f"Processing series: {series_name}")
+    if pool is not None:
+        pool.reset_peak()
     series_input_dir = os.path.join(input_dir, series_name)
     series_output_dir = os.path.join(output_dir, series_name)
     os.makedirs(series_output_dir, exist_ok=True)
     ### 
-    chapters = sorted([d for d in os.listdir(series_input_dir) if os.path.isdir(os.path.join(series_input_dir, d))])
-    volume_assignments = assign_volumes(chapters)
+    with metrics.timer("scan"):
+        get_catalog().refresh_series(series_input_dir)
+    chapters = sorted(get_chapter_sources(series_input_dir))
+    volume_assignments = assign_volumes(chapters, volume_map, batch)
+    unresolved = [chapter for chapter in chapters if chapter not in volume_assignments]
+    
+    # Pages made by earlier runs are skipped if their source and settings didn't change
+    manifest = Manifest(os.path.join(series_output_dir, ".manifest.json"))
     
     for chapter, volume in volume_assignments.items():
         volume_path = os.path.join(series_output_dir, volume)
         os.makedirs(volume_path, exist_ok=True)
-        process_chapter(series_input_dir, series_output_dir, chapter, volume, 1, target_ratio)
-    
-    
+        process_chapter(series_input_dir, series_output_dir, chapter, volume, 1, target_ratio, manifest, pool, encoder)
+        manifest.save()
 
-if __name__ == "__main__":
+    # With chapters left out this isn't a complete run, keep their old pages
+    removed = 0 if unresolved else manifest.remove_orphans()
+    manifest.save()
+
+    print(f"{series_name}: {page_stats['copied']} pages copied as-is, {page_stats['encoded']} pages re-encoded, "
+          f"{page_stats['skipped']} pages up to date, {removed} stale pages removed")
+    print(bytes_saved(page_stats))
+    if pool is not None:
+        peak = peak_memory_mb()
+        # The pool's peak is this series', the process can only tell its peak since the start
+        print(f"At most {pool.peak / 1024 / 1024:.0f} MB of decoded pages in flight for this series"
+              + (f", peak memory of the run so far {peak:.0f} MB" if peak is not None else ""))
+    page_stats.clear()
+    return unresolved
+
+def prepare_library(args):
     input_dir = "./input"
     output_dir = "./output"
     covers_dir = "./covers"
@@ -171,9 +438,49 @@ if __name__ == "__main__":
     target_ratio = (1836, 2448)
 
     series_list = sorted([d for d in os.listdir(input_dir) if os.path.isdir(os.path.join(input_dir, d))])
-    
+    unresolved = {}
+    pool = PagePool(args.jobs, args.memory_budget * 1024 * 1024)
+    encoder = page_encoder.from_args(args)
     
     for series in series_list:
-        process = get_user_input(f"Process series {series}? (y/n): ", ["y", "n"])
-        if process == "y":
-            process_series(series, input_dir, output_dir, target_ratio)
+        if not args.batch:
+            process = get_user_input(f"Process series {series}? (y/n): ", ["y", "n"])
+            if process != "y":
+                continue
+        
+        volume_map = load_volume_map(os.path.join(args.volume_maps, f"{series}.txt"))
+        try:
+            left_out = process_series(series, input_dir, output_dir, target_ratio, volume_map, args.batch, pool, encoder)
+        except ValueError as e:
+            if not args.batch:
+                raise
+            left_out = [f"series skipped: {e}"]
+        if left_out:
+            unresolved[series] = left_out
+    
+    pool.close()
+    
+    if unresolved:
+        print("\nChapters without a volume (add them to the volume map):")
+        for series, chapters in unresolved.items():
+            print(f"{series}:")
+            for chapter in chapters:
+                print(f"  - {chapter}")
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Crop and number the chapters in input/ into volumes in output/')
+    parser.add_argument('--batch', action='store_true',
+                       help='Process all series without asking, chapters without a volume are reported at the end')
+    parser.add_argument('--volume-maps', default="./volume_maps",
+                       help='Folder with a <series>.txt volume map per series (default: ./volume_maps)')
+    parser.add_argument('--jobs', type=int, default=1,
+                       help='Number of pages worked on at the same time (default: 1)')
+    parser.add_argument('--memory-budget', type=int, default=512,
+                       help='MB of decoded pages allowed in flight at once (default: 512)')
+    page_encoder.add_arguments(parser)
+    metrics.add_arguments(parser)
+    
+    args = parser.parse_args()
+    metrics.run(prepare_library, args, args)
@@ -1,6 +1,12 @@
 import shutil
 import os
-import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from chapter_names import parse_name
+from library_catalog import get_catalog
+from run_manifest import Manifest
+from dedupe_pages import LinkIndex
+import metrics
 
 move_operations = []
 
@@ -22,31 +28,79 @@ illegal_to_lookalike = {
     '|': 'ǀ'
 }
 
-def move_and_delete(path_1, path_2):
+# ioctl request to clone a file on copy-on-write filesystems (Linux btrfs/xfs)
+FICLONE = 0x40049409
+
+link_modes = ("copy", "hardlink", "reflink", "move")
+
+def copy_file(src, dst):
+    shutil.copy2(src, dst)
+
+def hardlink_file(src, dst):
+    try:
+        if os.path.exists(dst):
+            os.remove(dst)
+        os.link(src, dst)
+    except OSError:
+        # Different filesystem or no hardlink support
+        shutil.copy2(src, dst)
+
+def reflink_file(src, dst):
+    try:
+        import fcntl
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        shutil.copystat(src, dst)
+    except (ImportError, OSError):
+        # No copy-on-write support here
+        shutil.copy2(src, dst)
+
+def move_file(src, dst):
+    try:
+        os.replace(src, dst)
+    except OSError:
+        # Different filesystem
+        shutil.move(src, dst)
+
+def get_place_function(link_mode):
+    """Returns the function that puts a file at its destination for the given mode."""
+    return {
+        "copy": copy_file,
+        "hardlink": hardlink_file,
+        "reflink": reflink_file,
+        "move": move_file,
+    }[link_mode]
+
+def place_contents(path_1, path_2, link_mode):
+    """Puts all contents of path_1 into path_2 using the given link mode."""
+    place_file = get_place_function(link_mode)
+    for item in os.listdir(path_1):
+        s = os.path.join(path_1, item)
+        d = os.path.join(path_2, item)
+        if os.path.isdir(s):
+            shutil.copytree(s, d, copy_function=place_file)
+        else:
+            place_file(s, d)
+
+def move_and_delete(path_1, path_2, link_mode="move"):
     """Function to move contents and delete source directory."""
     try:
         if os.path.exists(path_1):
-            # Copy contents from path_1 to path_2
-            for item in os.listdir(path_1):
-                s = os.path.join(path_1, item)
-                d = os.path.join(path_2, item)
-                if os.path.isdir(s):
-                    shutil.copytree(s, d)
-                else:
-                    shutil.copy2(s, d)
+            # Move contents from path_1 to path_2
+            place_contents(path_1, path_2, link_mode)
             # Now delete all contents of path_1 (including the folder itself)
             shutil.rmtree(path_1)
             print(f"Moved and deleted: {path_1}")
     except Exception as e:
         print(f"Error processing {path_1}: {e}")
 
-def process_move_operations():
+def process_move_operations(link_mode="move"):
     """Process the move and delete operations once the program ends."""
     print("Processing move and delete operations...")
     try:
         for path_1, path_2 in move_operations:
             print(f"moving {path_1} to {path_2}")
-            move_and_delete(path_1, path_2)
+            move_and_delete(path_1, path_2, link_mode)
     except Exception as e:
         print(f"Error processing {path_1}: {e}")
     
@@ -90,117 +144,156 @@ def get_first_folder(directory):
     folders = [item for item in items if os.path.isdir(os.path.join(directory, item))]
     return folders[0] if folders else None
 
-def parse_title_with_vol(title):
-    # Split the title into its components
-    parts = title.split(' - ')
-
-    # Initialize variables
-    volume = chapter = chapter_part = chapter_name = 0
+def parse_title(title):
+    # Returns (volume, chapter, chapter part, chapter name) of a chapter folder
+    record = parse_name(title)
+    if record is None:
+        return "X", 0, 0, sub("Chapter 0")
 
-    if len(parts) == 2:
-        # Extract volume and chapter
-        vol_chap = parts[0].split(' ')
-        
-        # Handle missing volume
-        volume = vol_chap[0].split('.')[1] if vol_chap[0].startswith('Vol.') else 0
-
-        if len(vol_chap) > 1:
-            chapter_info = vol_chap[1].split('Ch.')
-            if len(chapter_info) > 1:
-                chapter = int(chapter_info[1].split('.')[0])
-                chapter_part = int(chapter_info[1].split('.')[1]) if '.' in chapter_info[1] else 0
-            else:
-                chapter = int(chapter_info[0].split('.')[0])
-                chapter_part = 0  # Default chapter part
-        else:
-            chapter = 0  # Default chapter if missing
-
-        # Extract chapter name and remove content after '(' or '['
-        chapter_name = parts[1]
-        if '(' in chapter_name:
-            chapter_name = chapter_name.split('(')[0].strip()
-        elif '[' in chapter_name:
-            chapter_name = chapter_name.split('[')[0].strip()
-    else:
-        # Handle case where there's no dash (e.g., "Ch.0086 (en) [My Darling]")
-        chapter_info = title.split('Ch.')
-        if len(chapter_info) > 1:
-            chapter_str = re.sub(r'[^\d.]', '', chapter_info[1])  # Remove non-numeric characters except dots
-            chapter_parts = chapter_str.split('.')
-            chapter = int(chapter_parts[0]) if chapter_parts[0] else 0
-            chapter_part = int(chapter_parts[1]) if len(chapter_parts) > 1 else 0
-        else:
-            chapter = 0
-            chapter_part = 0
-            
-        chapter_name = f"Chapter {chapter}"
+    volume = record.volume if record.volume is not None else "X"
+    chapter_name = record.title if record.title is not None else f"Chapter {record.chapter}"
+    return volume, record.chapter, record.part, sub(chapter_name)
         
-    chapter_name = sub(chapter_name)
+def copy_and_delete(path_1, path_2, link_mode="copy"):
+    # Ensure both paths exist
+    if os.path.exists(path_1) and os.path.isdir(path_1):
+        # Copy all contents of path_1 to path_2
+        place_contents(path_1, path_2, link_mode)
 
-    return volume, chapter, chapter_part, chapter_name
+class PagePlacer:
+    """
+    Bounded thread pool for placing pages. submit() blocks while `backlog`
+    pages are waiting, so planning never runs far ahead of the copying.
+    """
+    def __init__(self, jobs=8, backlog=None):
+        self.executor = ThreadPoolExecutor(max_workers=jobs)
+        self.slots = threading.BoundedSemaphore(backlog or jobs * 4)
+        self.futures = []
 
-def parse_title_with_wo_vol(title):
-    # Split the title into its components
-    parts = title.split(' - ')
+    def submit(self, function, *args):
+        self.slots.acquire()
+        future = self.executor.submit(function, *args)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
 
-    # Initialize variables
-    chapter = chapter_part = chapter_name = None
+    def wait(self):
+        """Waits for everything submitted and returns the results in submit order. Errors are raised here."""
+        futures, self.futures = self.futures, []
+        return [future.result() for future in futures]
 
-    if len(parts) == 2:
-        # Extract chapter and chapter part
-        chapter_info = parts[0].split('Ch.')
-        if len(chapter_info) > 1:
-            chapter = int(chapter_info[1].split('.')[0])
-            chapter_part = int(chapter_info[1].split('.')[1]) if '.' in chapter_info[1] else 0
-        else:
-            chapter = int(chapter_info[0].split('.')[0])
-            chapter_part = 0  # Default chapter part
-
-        # Extract chapter name (if present) and remove content after '(' or '['
-        chapter_name = parts[1]
-        if '(' in chapter_name:
-            chapter_name = chapter_name.split('(')[0].strip()
-        elif '[' in chapter_name:
-            chapter_name = chapter_name.split('[')[0].strip()
-    else:
-        # Handle case where there's no dash (e.g., "Ch.0086 (en) [My Darling]")
-        chapter_info = parts[0].split('Ch.')
-        if len(chapter_info) > 1:
-            chapter_str = re.sub(r'\D', '', chapter_info[1].split('(')[0])  # Remove non-numeric characters
-            chapter = int(chapter_str.split('.')[0])  # Convert to integer
-            chapter_part = int(chapter_info[1].split('.')[1]) if '.' in chapter_info[1] else 0
+    def close(self):
+        self.executor.shutdown()
+
+def place_page(manifest, place, source, target, kind, size, links=None):
+    """
+    Places one page or cover, unless the manifest says it's up to date.
+    With a LinkIndex, pages identical to one placed before become hardlinks to it.
+    Returns True if it was skipped.
+    """
+    source_hash = manifest.source_hash(source)
+    if manifest.is_fresh(target, source_hash, kind):
+        # The placed bytes are the source's, so its hash is the page's
+        if links is not None and links.link(target, source_hash):
+            manifest.restat(target)
+        return True
+    try:
+        if os.stat(target).st_nlink > 1:
+            # Linked pages share their bytes, writing into this one would change the others
+            os.remove(target)
+    except FileNotFoundError:
+        pass
+    with metrics.timer("place"):
+        place(source, target)
+    metrics.add_bytes("place", size)
+    if links is not None:
+        links.link(target, source_hash)
+    manifest.record(target, source_hash, kind, source_hash)
+    return False
+
+class ChapterNamer:
+    """
+    Works out the manga/ folder of each chapter of a series, fed in volume and name order.
+    Parts of a chapter share its folder and continue its page numbers,
+    chapters with the same title as the one before get " - 2", " - 3", ...
+    """
+    def __init__(self, series_folder, width):
+        self.series_folder = series_folder
+        self.width = int(width)
+        self.prev_chap_numb = -1
+        self.prev_title = ""
+        self.prev_title_numb = 2
+        self.count = 1
+
+    def start_volume(self):
+        self.count = 1
+
+    def add(self, subfolder, chap):
+        """Returns (parsed title, folder, title) of the chapter folder chap."""
+        current = parse_title(chap)
+
+
+        title_current = ""
+
+        if not current[1] == self.prev_chap_numb:
+            self.count = 1
+
+        title_current = current[3]
+        if self.prev_title == current[3]:
+            if self.prev_chap_numb != current[1]:
+                title_current = f"{current[3]} - {self.prev_title_numb}"
+                self.prev_title_numb+=1
+            else:
+                self.prev_title_numb=2
         else:
-            chapter_str = re.sub(r'\D', '', chapter_info[0].split('(')[0])  # Remove non-numeric characters
-            chapter = int(chapter_str.split('.')[0])  # Convert to integer
-            chapter_part = 0  # Default chapter part
-
-        # Default chapter name format
-        chapter_name = f"Chapter {chapter}"
-    chapter_name = sub(chapter_name)
-    return "X", chapter, chapter_part, chapter_name
-    
-def parse_title(title):
-    if title[0] == 'V':
-        return parse_title_with_vol(title)
-    else:
-        return parse_title_with_wo_vol(title)
-        
-def copy_and_delete(path_1, path_2):
-    # Ensure both paths exist
-    if os.path.exists(path_1) and os.path.isdir(path_1):
-        # Copy all contents of path_1 to path_2
-        for item in os.listdir(path_1):
-            s = os.path.join(path_1, item)
-            d = os.path.join(path_2, item)
-            
-            if os.path.isdir(s):
-                # If it's a directory, copy it recursively
-                shutil.copytree(s, d)
+                self.prev_title_numb=2
+
+        if self.prev_chap_numb == current[1]:
+
+            if self.prev_title == f"Chapter {current[1]}":
+                print(f"Chapter {current[1]} == {self.prev_title}")
+                new_path = f"./manga/{self.series_folder}/{self.series_folder} {subfolder}/{str(current[1]).zfill(self.width)} - {title_current}/"
+                old_path = f"./manga/{self.series_folder}/{self.series_folder} {subfolder}/{str(current[1]).zfill(self.width)} - {self.prev_title}/"
+                move_operations.append((old_path, new_path))
+                self.prev_title = current[3]
             else:
-                # If it's a file, copy it
-                shutil.copy2(s, d)
+                print(f"using {self.prev_title}")
+                new_path = f"./manga/{self.series_folder}/{self.series_folder} {subfolder}/{str(current[1]).zfill(self.width)} - {self.prev_title}/"
+        else:
+            self.prev_title = current[3]
+            self.prev_chap_numb = current[1] 
+            new_path = f"./manga/{self.series_folder}/{self.series_folder} {subfolder}/{str(current[1]).zfill(self.width)} - {title_current}/"
+        return current, new_path, title_current
+
+    def page_path(self, new_path, extension=".jpg"):
+        """Path of the next page in the chapter folder."""
+        path = os.path.join(new_path, f"{str(self.count).zfill(3)}{extension}")
+        self.count += 1
+        return path
+
+def scan_series_folder(directory, link_mode="copy", jobs=8, dedupe=False, prune=False):
+    placer = PagePlacer(jobs)
+    links = LinkIndex() if dedupe else None
+    try:
+        place_series(directory, link_mode, placer, links, prune)
+    finally:
+        placer.close()
+    if links is not None:
+        print(f"{links.linked} duplicate pages linked, {links.reclaimed / 1024 / 1024:.1f} MB reclaimed")
 
-def scan_series_folder(directory):
+def report_unplaced(manifest, prune):
+    """
+    Pages placed by earlier runs but not by this one (their chapter is no
+    longer in output/) stay in manga/ unless prune is set. Returns a summary.
+    """
+    if prune:
+        return f"{manifest.remove_orphans(verbose=True)} pages not placed again removed"
+    unplaced = len(manifest.orphans())
+    return f"{unplaced} pages from earlier runs kept" + (" (--prune removes them)" if unplaced else "")
+
+def place_series(directory, link_mode, placer, links=None, prune=False):
+    place_file = get_place_function(link_mode)
+    # Covers are shared between runs, never move them away
+    place_cover = get_place_function("copy" if link_mode == "move" else link_mode)
     if not os.path.exists(directory):
         print(f"The directory {directory} does not exist.")
         return
@@ -215,12 +308,19 @@ def scan_series_folder(directory):
                 width = input(f"length of chap string (eg. 2 = 01, 3 = 001): ")
                 print(f"Contents of {series_folder}:")
                 
-                prev_chap_numb = -1
-                prev_title = ""
-                prev_title_numb = 2
+                namer = ChapterNamer(series_folder, width)
+                
+                catalog = get_catalog()
+                with metrics.timer("scan"):
+                    catalog.refresh_series(series_path, volumes=True)
                 
-                for subfolder in os.listdir(series_path):
-                    subfolder_path = os.path.join(series_path, subfolder)
+                # Pages placed by earlier runs are skipped if their source didn't change
+                manifest = Manifest(f"./manga/{series_folder}/.manifest.json")
+                skipped = 0
+                
+                for volume in catalog.volumes(series_path):
+                    subfolder = volume["name"]
+                    subfolder_path = volume["path"]
                     
                     
                     
@@ -228,72 +328,57 @@ def scan_series_folder(directory):
                     if os.path.isdir(subfolder_path):
                         print(f"  - {subfolder}")
                         
-                    count = 1
-                    for chap in os.listdir(subfolder_path):
-                        chap_path = os.path.join(subfolder_path, chap)
-                        current = parse_title(chap)
-                        
-                        
-                        title_current = ""
-                        
-                        if not current[1] == prev_chap_numb:
-                            count = 1
-                        
-                        title_current = current[3]
-                        if prev_title == current[3]:
-                            if prev_chap_numb != current[1]:
-                                title_current = f"{current[3]} - {prev_title_numb}"
-                                prev_title_numb+=1
-                            else:
-                                prev_title_numb=2
-                        else:
-                                prev_title_numb=2
-                        
-                        if prev_chap_numb == current[1]:
-                            
-                            if prev_title == f"Chapter {current[1]}":
-                                print(f"Chapter {current[1]} == {prev_title}")
-                                new_path = f"./manga/{series_folder}/{series_folder} {subfolder}/{str(current[1]).zfill(int(width))} - {title_current}/"
-                                old_path = f"./manga/{series_folder}/{series_folder} {subfolder}/{str(current[1]).zfill(int(width))} - {prev_title}/"
-                                move_operations.append((old_path, new_path))
-                                prev_title = current[3]
-                            else:
-                                print(f"using {prev_title}")
-                                new_path = f"./manga/{series_folder}/{series_folder} {subfolder}/{str(current[1]).zfill(int(width))} - {prev_title}/"
-                        else:
-                            prev_title = current[3]
-                            prev_chap_numb = current[1] 
-                            new_path = f"./manga/{series_folder}/{series_folder} {subfolder}/{str(current[1]).zfill(int(width))} - {title_current}/"
-                        
-                       
+                    namer.start_volume()
+                    volume_dirs = {}
+                    volume_pages = []
+                    for chapter in catalog.volume_chapters(subfolder_path):
+                        if chapter["kind"] != "folder":
+                            continue
+                        chap = chapter["name"]
+                        chap_path = chapter["path"]
+                        current, new_path, title_current = namer.add(subfolder, chap)
                         
                         print(f"      - {current[1]}: {title_current}")
                         
                         
-                        if not os.path.exists(new_path):
-                            os.makedirs(new_path)
-                            
-                        for file in os.listdir(chap_path):
-                            page_path = os.path.join(chap_path, file)
-                            
-                            new_file_path = os.path.join(new_path, f"{str(count).zfill(3)}.jpg")
-                            
-                            shutil.copy(page_path, new_file_path)
+                        volume_dirs.setdefault(new_path)
                             
+                        for page in catalog.pages(chap_path):
+                            page_path = page["path"]
                             
-                            # print(f"            - page {count} saved")
-                            count+=1
+                            # Pages keep their format (.jpg, or .webp from initial_prepare --webp)
+                            new_file_path = namer.page_path(new_path, os.path.splitext(page["name"])[1].lower())
+                            volume_pages.append((page_path, new_file_path, page["size"]))
+                    
+                    # All folders of the volume exist before any page is placed
+                    for new_path in volume_dirs:
+                        os.makedirs(new_path, exist_ok=True)
+                    for page_path, new_file_path, size in volume_pages:
+                        placer.submit(place_page, manifest, place_file, page_path, new_file_path, "page", size, links)
+                    
                     volume_num = extract_volume(subfolder)
                     cover_path = f"./covers/{series_folder}/"
                     
                     if os.path.exists(f"{cover_path}{volume_num}.jpg"):
-                        shutil.copy(f"{cover_path}{volume_num}.jpg", f"./manga/{series_folder}/{series_folder} {subfolder}/{get_first_folder(f"./manga/{series_folder}/{series_folder} {subfolder}/")}/{str("0").zfill(int(3))}.jpg")
+                        cover_file = f"./manga/{series_folder}/{series_folder} {subfolder}/{get_first_folder(f"./manga/{series_folder}/{series_folder} {subfolder}/")}/{str("0").zfill(int(3))}.jpg"
+                        placer.submit(place_page, manifest, place_cover, f"{cover_path}{volume_num}.jpg", cover_file, "cover",
+                                      os.path.getsize(f"{cover_path}{volume_num}.jpg"), links)
                         print("cover copiumed")
                         print(f"from {cover_path}{volume_num}.jpg")
                         print(f"to ./manga/{series_folder}/{series_folder} {subfolder}/{get_first_folder(f"./manga/{series_folder}/{series_folder} {subfolder}/")}/{str("0").zfill(int(3))}.jpg")
                     else:
                         print(f"Cover for Vol.{volume_num} does not exist in .mange dir")
                 
+                    # Only pages count towards skipped, the cover comes after them
+                    skipped += sum(placer.wait()[:len(volume_pages)])
+                    manifest.save()
+                    if links is not None:
+                        links.store()
+                
+                unplaced = report_unplaced(manifest, prune)
+                manifest.save()
+                print(f"{skipped} pages were already up to date, {unplaced}")
+                
                 remove = input("remove original dir? Y/N: ")
                 
                 if remove == "y":
@@ -318,8 +403,25 @@ def scan_series_folder(directory):
             else:
                 print(f"Skipped {series_folder}.")
 
-# Set the path to your .output directory
-output_dir = "./output"  # Change this to the appropriate path
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Wrap processed chapters from output/ into volumes in manga/')
+    parser.add_argument('--link-mode', choices=link_modes, default="copy",
+                       help='How pages are placed: copy, hardlink, reflink (copy-on-write clone) or move (default: copy)')
+    parser.add_argument('--jobs', type=int, default=8,
+                       help='Number of pages placed at the same time (default: 8)')
+    parser.add_argument('--dedupe', action='store_true',
+                       help='Replace pages identical to one already in manga/ with hardlinks to it')
+    
+    parser.add_argument('--prune', action='store_true',
+                       help='Delete pages placed by earlier runs that this run did not place again (eg. their chapter left output/), each one is printed')
+    metrics.add_arguments(parser)
+    
+    args = parser.parse_args()
+    
+    # Set the path to your .output directory
+    output_dir = "./output"  # Change this to the appropriate path
 
-# Run the function
-scan_series_folder(output_dir)
+    # Run the function
+    metrics.run(scan_series_folder, args, output_dir, args.link_mode, args.jobs, args.dedupe, args.prune)
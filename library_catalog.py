@@ -0,0 +1,287 @@
+import os
+import sqlite3
+import zipfile
+from chapter_names import parse_name
+
+# SQLite catalog of series, volumes, chapters and pages shared by the scripts.
+# Directories are only listed again when their mtime changed since the last refresh.
+
+default_db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "library.db")
+
+schema = """
+CREATE TABLE IF NOT EXISTS series (
+    id INTEGER PRIMARY KEY, path TEXT UNIQUE, name TEXT, mtime INTEGER
+);
+CREATE TABLE IF NOT EXISTS volumes (
+    id INTEGER PRIMARY KEY, series_id INTEGER REFERENCES series(id) ON DELETE CASCADE,
+    path TEXT UNIQUE, name TEXT, mtime INTEGER
+);
+CREATE TABLE IF NOT EXISTS chapters (
+    id INTEGER PRIMARY KEY, series_id INTEGER REFERENCES series(id) ON DELETE CASCADE,
+    volume_id INTEGER REFERENCES volumes(id) ON DELETE CASCADE,
+    path TEXT UNIQUE, name TEXT, kind TEXT, mtime INTEGER,
+    volume TEXT, chapter INTEGER, part INTEGER, title TEXT, language TEXT, translator TEXT
+);
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY, chapter_id INTEGER REFERENCES chapters(id) ON DELETE CASCADE,
+    path TEXT, name TEXT, size INTEGER, mtime INTEGER
+);
+CREATE TABLE IF NOT EXISTS file_checks (
+    path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, deep INTEGER, valid INTEGER
+);
+CREATE TABLE IF NOT EXISTS page_hashes (
+    path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, hash TEXT
+);
+CREATE INDEX IF NOT EXISTS page_hashes_hash ON page_hashes (hash);
+CREATE INDEX IF NOT EXISTS chapters_series_name ON chapters (series_id, name);
+CREATE INDEX IF NOT EXISTS chapters_series_chapter ON chapters (series_id, chapter);
+CREATE INDEX IF NOT EXISTS chapters_volume ON chapters (volume_id, name);
+CREATE INDEX IF NOT EXISTS pages_chapter ON pages (chapter_id, name);
+"""
+
+def parse_chapter_name(name):
+    """Returns (volume, chapter, part, title, language, translator) of a chapter name."""
+    record = parse_name(name)
+    if record is None:
+        return None, None, None, None, None, None
+    return record.volume, record.chapter, record.part, record.title, record.language, record.translator
+
+class LibraryCatalog:
+    def __init__(self, db_path=default_db_path):
+        self.db = sqlite3.connect(db_path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.executescript(schema)
+
+    # Refreshing
+
+    def refresh_series(self, series_path, volumes=False):
+        """
+        Brings the catalog of one series folder up to date.
+        With volumes=True the series holds volume folders that hold the chapters
+        (the output/ layout), otherwise chapters sit directly in the series folder.
+        """
+        series_path = os.path.abspath(series_path)
+        mtime = os.stat(series_path).st_mtime_ns
+        row = self.db.execute("SELECT id, mtime FROM series WHERE path = ?", (series_path,)).fetchone()
+        if row:
+            series_id, changed = row["id"], row["mtime"] != mtime
+        else:
+            series_id = self.db.execute(
+                "INSERT INTO series (path, name, mtime) VALUES (?, ?, NULL)",
+                (series_path, os.path.basename(series_path))
+            ).lastrowid
+            changed = True
+
+        if volumes:
+            if changed:
+                self.sync_volumes(series_id, series_path)
+            for volume in self.db.execute("SELECT id, path, mtime FROM volumes WHERE series_id = ?", (series_id,)).fetchall():
+                volume_mtime = os.stat(volume["path"]).st_mtime_ns
+                self.refresh_chapters(series_id, volume["id"], volume["path"], volume_mtime != volume["mtime"])
+                self.db.execute("UPDATE volumes SET mtime = ? WHERE id = ?", (volume_mtime, volume["id"]))
+        else:
+            self.refresh_chapters(series_id, None, series_path, changed)
+
+        self.db.execute("UPDATE series SET mtime = ? WHERE id = ?", (mtime, series_id))
+        self.db.commit()
+        return series_id
+
+    def sync_volumes(self, series_id, series_path):
+        found = {
+            os.path.join(series_path, d): d for d in os.listdir(series_path)
+            if os.path.isdir(os.path.join(series_path, d))
+        }
+        known = {row["path"] for row in self.db.execute("SELECT path FROM volumes WHERE series_id = ?", (series_id,))}
+
+        self.db.executemany("DELETE FROM volumes WHERE path = ?", [(path,) for path in known - found.keys()])
+        self.db.executemany(
+            "INSERT INTO volumes (series_id, path, name, mtime) VALUES (?, ?, ?, NULL)",
+            [(series_id, path, found[path]) for path in found.keys() - known]
+        )
+
+    def refresh_chapters(self, series_id, volume_id, directory, changed):
+        if changed:
+            self.sync_chapters(series_id, volume_id, directory)
+
+        rows = self.db.execute(
+            "SELECT id, path, kind, mtime FROM chapters WHERE series_id = ? AND volume_id IS ?",
+            (series_id, volume_id)
+        ).fetchall()
+        for chapter in rows:
+            try:
+                chapter_mtime = os.stat(chapter["path"]).st_mtime_ns
+            except FileNotFoundError:
+                self.db.execute("DELETE FROM chapters WHERE id = ?", (chapter["id"],))
+                continue
+            if chapter_mtime != chapter["mtime"]:
+                self.sync_pages(chapter["id"], chapter["path"], chapter["kind"])
+                self.db.execute("UPDATE chapters SET mtime = ? WHERE id = ?", (chapter_mtime, chapter["id"]))
+
+    def sync_chapters(self, series_id, volume_id, directory):
+        found = {}
+        for entry in os.listdir(directory):
+            path = os.path.join(directory, entry)
+            if os.path.isdir(path):
+                found[path] = (entry, "folder")
+            elif entry.lower().endswith(".cbz"):
+                found[path] = (entry[:-4], "cbz")
+
+        known = {row["path"] for row in self.db.execute(
+            "SELECT path FROM chapters WHERE series_id = ? AND volume_id IS ?", (series_id, volume_id))}
+
+        self.db.executemany("DELETE FROM chapters WHERE path = ?", [(path,) for path in known - found.keys()])
+        self.db.executemany(
+            "INSERT INTO chapters (series_id, volume_id, path, name, kind, mtime, volume, chapter, part, title, language, translator)"
+            " VALUES (?, ?, ?, ?, ?, NULL, ?, ?, ?, ?, ?, ?)",
+            [
+                (series_id, volume_id, path, found[path][0], found[path][1], *parse_chapter_name(found[path][0]))
+                for path in found.keys() - known
+            ]
+        )
+
+    def sync_pages(self, chapter_id, chapter_path, kind):
+        self.db.execute("DELETE FROM pages WHERE chapter_id = ?", (chapter_id,))
+
+        if kind == "cbz":
+            # Pages of an archive come from its central directory
+            mtime = os.stat(chapter_path).st_mtime_ns
+            try:
+                with zipfile.ZipFile(chapter_path) as cbz_file:
+                    pages = [
+                        (chapter_id, os.path.join(chapter_path, info.filename), info.filename, info.file_size, mtime)
+                        for info in cbz_file.infolist() if not info.is_dir()
+                    ]
+            except zipfile.BadZipFile:
+                pages = []
+        else:
+            pages = []
+            with os.scandir(chapter_path) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        pages.append((chapter_id, entry.path, entry.name, stat.st_size, stat.st_mtime_ns))
+
+        self.db.executemany("INSERT INTO pages (chapter_id, path, name, size, mtime) VALUES (?, ?, ?, ?, ?)", pages)
+
+    # Queries, run refresh_series first
+
+    def series_id(self, series_path):
+        row = self.db.execute("SELECT id FROM series WHERE path = ?", (os.path.abspath(series_path),)).fetchone()
+        return row["id"] if row else None
+
+    def chapters(self, series_path, prefix=""):
+        """Chapters of a series (folders and .cbz archives) by name, optionally starting with prefix."""
+        return self.db.execute(
+            "SELECT * FROM chapters WHERE series_id = ? AND name >= ? AND name < ? ORDER BY name, kind DESC",
+            (self.series_id(series_path), prefix, prefix + "\U0010ffff")
+        ).fetchall()
+
+    def chapter_parts(self, series_path, chapter):
+        """All uploads of chapter number X: its parts (X.1, X.2, ...) and duplicates."""
+        return self.db.execute(
+            "SELECT * FROM chapters WHERE series_id = ? AND chapter = ? ORDER BY part, name",
+            (self.series_id(series_path), chapter)
+        ).fetchall()
+
+    def missing_chapters(self, series_path, start=None, end=None):
+        """Chapter numbers in [start, end] that no chapter of the series has."""
+        rows = self.db.execute(
+            "SELECT DISTINCT chapter FROM chapters WHERE series_id = ? AND chapter IS NOT NULL",
+            (self.series_id(series_path),)
+        ).fetchall()
+        present = {row["chapter"] for row in rows}
+        if not present:
+            return []
+        start = min(present) if start is None else start
+        end = max(present) if end is None else end
+        return [number for number in range(start, end + 1) if number not in present]
+
+    def volumes(self, series_path):
+        return self.db.execute(
+            "SELECT * FROM volumes WHERE series_id = ? ORDER BY name", (self.series_id(series_path),)
+        ).fetchall()
+
+    def volume_chapters(self, volume_path):
+        return self.db.execute(
+            "SELECT chapters.* FROM chapters JOIN volumes ON chapters.volume_id = volumes.id"
+            " WHERE volumes.path = ? ORDER BY chapters.name",
+            (os.path.abspath(volume_path),)
+        ).fetchall()
+
+    def pages(self, chapter_path):
+        return self.db.execute(
+            "SELECT pages.* FROM pages JOIN chapters ON pages.chapter_id = chapters.id"
+            " WHERE chapters.path = ? ORDER BY pages.name",
+            (os.path.abspath(chapter_path),)
+        ).fetchall()
+
+    def volume_pages(self, volume_path):
+        """Pages of volume Y, in chapter and page order."""
+        return self.db.execute(
+            "SELECT pages.* FROM pages JOIN chapters ON pages.chapter_id = chapters.id"
+            " JOIN volumes ON chapters.volume_id = volumes.id"
+            " WHERE volumes.path = ? ORDER BY chapters.name, pages.name",
+            (os.path.abspath(volume_path),)
+        ).fetchall()
+
+    # Image check verdicts of clean_up_folders, keyed by path, size and mtime
+
+    def rows_by_path(self, table, paths):
+        paths = list(paths)
+        # Stay below SQLite's limit on query parameters
+        for start in range(0, len(paths), 500):
+            chunk = paths[start:start + 500]
+            yield from self.db.execute(
+                f"SELECT * FROM {table} WHERE path IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+
+    def file_checks(self, paths):
+        """Returns {path: (size, mtime, deep, valid)} for the paths checked before."""
+        return {
+            row["path"]: (row["size"], row["mtime"], bool(row["deep"]), bool(row["valid"]))
+            for row in self.rows_by_path("file_checks", paths)
+        }
+
+    def store_file_checks(self, checks):
+        """Stores (path, size, mtime, deep, valid) verdicts."""
+        self.db.executemany("INSERT OR REPLACE INTO file_checks (path, size, mtime, deep, valid) VALUES (?, ?, ?, ?, ?)", checks)
+
+    def forget_files(self, paths):
+        self.db.executemany("DELETE FROM file_checks WHERE path = ?", [(path,) for path in paths])
+
+    # Content hashes of pages in manga/ for dedupe_pages, keyed by absolute path, size and mtime
+
+    def page_hashes(self, paths):
+        """Returns {path: (size, mtime, hash)} for the paths hashed before."""
+        return {row["path"]: (row["size"], row["mtime"], row["hash"]) for row in self.rows_by_path("page_hashes", paths)}
+
+    def hashes_below(self, root):
+        """(path, size, mtime, hash) of every page hashed below the folder root."""
+        root = os.path.join(os.path.abspath(root), "")
+        return self.db.execute(
+            "SELECT path, size, mtime, hash FROM page_hashes WHERE path >= ? AND path < ?", (root, root + "\U0010ffff")
+        ).fetchall()
+
+    def store_page_hashes(self, hashes):
+        """Stores (path, size, mtime, hash) rows."""
+        self.db.executemany("INSERT OR REPLACE INTO page_hashes (path, size, mtime, hash) VALUES (?, ?, ?, ?)", hashes)
+
+    def forget_page_hashes(self, paths):
+        self.db.executemany("DELETE FROM page_hashes WHERE path = ?", [(path,) for path in paths])
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+catalog = None
+
+def get_catalog():
+    """The catalog shared by everything in this process."""
+    global catalog
+    if catalog is None:
+        catalog = LibraryCatalog()
+    return catalog
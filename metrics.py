@@ -0,0 +1,155 @@
+import sys
+import json
+import time
+from collections import Counter, defaultdict
+
+# Timers and counters around the expensive steps of the scripts (decoding,
+# border detection, encoding, copying, directory scans).
+# Off by default: timer() then hands out one shared do-nothing context manager.
+#
+#   with metrics.timer("open"):
+#       img = Image.open(path)
+#   metrics.add_bytes("open", os.path.getsize(path))
+
+enabled = False
+timings = defaultdict(list)
+byte_counts = Counter()
+errors = Counter()
+started = None
+
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+null_timer = NullTimer()
+
+class Timer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        timings[self.name].append(time.perf_counter() - self.start)
+        if exc_type is not None:
+            errors[self.name] += 1
+        return False
+
+def enable():
+    """Starts measuring. Also used as worker initializer, so forked workers start empty."""
+    global enabled, started
+    enabled = True
+    started = time.perf_counter()
+    drain()
+
+def timer(name):
+    """Times the with-block under name, exceptions count as errors of name."""
+    return Timer(name) if enabled else null_timer
+
+def add_bytes(name, size):
+    if enabled:
+        byte_counts[name] += size
+
+def error(name):
+    if enabled:
+        errors[name] += 1
+
+def drain():
+    """Returns what was measured so far and forgets it, to pass results from a worker process."""
+    data = (dict(timings), dict(byte_counts), dict(errors))
+    timings.clear()
+    byte_counts.clear()
+    errors.clear()
+    return data
+
+def merge(data):
+    worker_timings, worker_bytes, worker_errors = data
+    for name, values in worker_timings.items():
+        timings[name].extend(values)
+    byte_counts.update(worker_bytes)
+    errors.update(worker_errors)
+
+def run_drained(function, *args):
+    """Runs function in a worker process, returns (result, drained measurements)."""
+    return function(*args), drain()
+
+def merged(results):
+    """Merges the measurements of run_drained results and yields the plain results, in order."""
+    for result, data in results:
+        merge(data)
+        yield result
+
+def maxrss_mb(maxrss):
+    """ru_maxrss in MB: it is in kilobytes on Linux and in bytes on macOS."""
+    return maxrss / 1024 / 1024 if sys.platform == "darwin" else maxrss / 1024
+
+def percentile(values, share):
+    return values[round(share * (len(values) - 1))]
+
+def summary():
+    """
+    Per-step summary. Rates are per second of the whole run, latencies are
+    per call; with worker processes the summed seconds can exceed the run time.
+    """
+    wall = time.perf_counter() - started
+    steps = {}
+    for name in sorted(timings.keys() | byte_counts.keys() | errors.keys()):
+        values = sorted(timings.get(name, []))
+        step = {
+            "count": len(values),
+            "seconds": sum(values),
+            "per_second": len(values) / wall,
+            "bytes": byte_counts[name],
+            "mb_per_second": byte_counts[name] / 1024 / 1024 / wall,
+            "errors": errors[name],
+        }
+        if values:
+            step.update(p50_ms=percentile(values, 0.5) * 1000, p95_ms=percentile(values, 0.95) * 1000,
+                        max_ms=values[-1] * 1000)
+        steps[name] = step
+    return {"script": sys.argv[0], "wall_seconds": wall, "steps": steps}
+
+def write_summary(path):
+    result = summary()
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+
+    print(f"\nMetrics ({result['wall_seconds']:.2f}s), saved to {path}:")
+    for name, step in result["steps"].items():
+        latency = f", p50 {step['p50_ms']:.1f} ms, p95 {step['p95_ms']:.1f} ms" if step["count"] else ""
+        print(f"  {name}: {step['count']} x{latency}, {step['per_second']:.1f}/s, "
+              f"{step['mb_per_second']:.1f} MB/s, {step['errors']} errors")
+
+def add_arguments(parser):
+    parser.add_argument('--metrics', metavar='FILE',
+                        help='Write time, throughput, latency and error counts per step to a JSON file')
+    parser.add_argument('--profile', action='store_true',
+                        help='Run under cProfile and print the functions that took the most time')
+
+def run(main, args, *main_args):
+    """Runs main(*main_args) with the --metrics and --profile options of args."""
+    if args.metrics:
+        enable()
+
+    if args.profile:
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(main, *main_args)
+        finally:
+            stats = pstats.Stats(profiler)
+            stats.sort_stats("cumulative").print_stats(25)
+            stats.sort_stats("tottime").print_stats(25)
+    else:
+        main(*main_args)
+
+    if args.metrics:
+        write_summary(args.metrics)
@@ -0,0 +1,127 @@
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree as ET
+import metrics
+
+manga_dir = "./manga"
+cbz_dir = "./cbz"
+
+page_extensions = ('.jpg', '.jpeg', '.png', '.webp')
+
+def parse_volume(volume_folder):
+    # "<series> Vol.01" -> "01"
+    return volume_folder.rsplit("Vol.", 1)[1] if "Vol." in volume_folder else None
+
+def parse_chapter(chapter_folder):
+    # "001 - Title" -> ("001", "Title")
+    number, _, title = chapter_folder.partition(" - ")
+    return number, title
+
+def get_folders(directory):
+    return sorted(d for d in os.listdir(directory) if os.path.isdir(os.path.join(directory, d)))
+
+def get_pages(directory):
+    return sorted(f for f in os.listdir(directory) if f.lower().endswith(page_extensions))
+
+def make_comic_info(series, volume, number=None, title=None, page_count=0):
+    """
+    Builds ComicInfo.xml for a chapter or volume archive.
+    """
+    info = ET.Element("ComicInfo", {
+        "xmlns:xsi": "http://www.w3.org/2001/XMLSchema-instance",
+        "xmlns:xsd": "http://www.w3.org/2001/XMLSchema",
+    })
+    fields = [
+        ("Series", series),
+        ("Title", title),
+        ("Number", number.lstrip("0") or "0" if number else None),
+        ("Volume", volume.lstrip("0") or "0" if volume and volume.isdigit() else None),
+        ("PageCount", str(page_count)),
+        ("Manga", "YesAndRightToLeft"),
+    ]
+    for name, value in fields:
+        if value:
+            ET.SubElement(info, name).text = value
+    return ET.tostring(info, encoding="utf-8", xml_declaration=True)
+
+def write_cbz(cbz_path, entries, comic_info):
+    """
+    Writes (archive name, file path) entries into a .cbz with stored entries.
+    Pages are streamed from disk in chunks, never read whole into memory.
+    """
+    os.makedirs(os.path.dirname(cbz_path), exist_ok=True)
+    temp_path = cbz_path + ".part"
+
+    with metrics.timer("archive"), zipfile.ZipFile(temp_path, "w", compression=zipfile.ZIP_STORED) as cbz_file:
+        for arcname, path in entries:
+            cbz_file.write(path, arcname)
+        cbz_file.writestr("ComicInfo.xml", comic_info)
+
+    # Only replace the archive once it's complete
+    os.replace(temp_path, cbz_path)
+    metrics.add_bytes("archive", os.path.getsize(cbz_path))
+    return cbz_path
+
+def plan_archives(series, per):
+    """
+    Returns (cbz path, entries, ComicInfo.xml) for every archive of a series,
+    one per chapter or one per volume.
+    """
+    series_path = os.path.join(manga_dir, series)
+    archives = []
+
+    for volume_folder in get_folders(series_path):
+        volume_path = os.path.join(series_path, volume_folder)
+        volume = parse_volume(volume_folder)
+        volume_entries = []
+
+        for chapter_folder in get_folders(volume_path):
+            chapter_path = os.path.join(volume_path, chapter_folder)
+            entries = [(page, os.path.join(chapter_path, page)) for page in get_pages(chapter_path)]
+
+            if per == "chapter":
+                number, title = parse_chapter(chapter_folder)
+                archives.append((
+                    os.path.join(cbz_dir, series, volume_folder, f"{chapter_folder}.cbz"),
+                    entries,
+                    make_comic_info(series, volume, number, title, len(entries)),
+                ))
+            else:
+                volume_entries.extend((f"{chapter_folder}/{page}", path) for page, path in entries)
+
+        if per == "volume" and volume_entries:
+            archives.append((
+                os.path.join(cbz_dir, series, f"{volume_folder}.cbz"),
+                volume_entries,
+                make_comic_info(series, volume, title=volume_folder, page_count=len(volume_entries)),
+            ))
+
+    return archives
+
+def pack_series(series, per="chapter", jobs=4):
+    with metrics.timer("scan"):
+        archives = plan_archives(series, per)
+    print(f"Packing {len(archives)} archives for {series}")
+
+    # Stored entries make this I/O bound, so threads are enough
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for cbz_path in executor.map(lambda archive: write_cbz(*archive), archives):
+            print(f"  - {cbz_path}")
+
+def pack_library(per="chapter", jobs=4):
+    for series in get_folders(manga_dir):
+        pack_series(series, per, jobs)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Pack the finished manga/ tree into .cbz archives in cbz/')
+    parser.add_argument('--per', choices=("chapter", "volume"), default="chapter",
+                       help='One archive per chapter or per volume (default: chapter)')
+    parser.add_argument('--jobs', type=int, default=4,
+                       help='Number of archives written at the same time (default: 4)')
+    metrics.add_arguments(parser)
+
+    args = parser.parse_args()
+    metrics.run(pack_library, args, args.per, args.jobs)
@@ -0,0 +1,152 @@
+import os
+import numpy as np
+from PIL import Image, JpegImagePlugin
+from border_crop import band_pixels
+
+# How pages are saved by initiall_prepare and trimm_pages. Pages whose pixels
+# are all gray (most scans, even when they come as RGB) are saved with a
+# single channel, which makes them smaller and faster to encode.
+
+# Largest difference between the channels of a pixel that still counts as gray,
+# covers the color fringes JPEG leaves around black lines
+gray_tolerance = 8
+
+gray_modes = ('1', 'L', 'LA', 'I', 'I;16', 'F')
+
+subsampling_choices = ('keep', '4:4:4', '4:2:2', '4:2:0')
+
+def is_grayscale(img, tolerance=gray_tolerance):
+    """
+    True if no pixel's channels differ by more than tolerance. Compared in
+    bands of rows, stops at the first band with color in it.
+    """
+    if img.mode in gray_modes:
+        return True
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGB')
+
+    width, height = img.size
+    band_rows = max(1, band_pixels // width)
+    for start in range(0, height, band_rows):
+        band = np.asarray(img.crop((0, start, width, min(height, start + band_rows))))
+        # Elementwise over the channel planes, reducing along the channel axis is several times slower
+        red, green, blue = band[:, :, 0], band[:, :, 1], band[:, :, 2]
+        spread = np.maximum(np.maximum(red, green), blue) - np.minimum(np.minimum(red, green), blue)
+        if spread.max() > tolerance:
+            return False
+    return True
+
+def replace_file(path, write):
+    """
+    Calls write(temp_path) and moves the file it wrote over path. The old file
+    is replaced rather than rewritten, so pages hardlinked to it (last_step
+    --link-mode hardlink, dedupe_pages) keep their bytes.
+    """
+    temp_path = path + ".tmp"
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def source_jpeg_settings(img):
+    """Quantization tables and subsampling of a JPEG source, empty for anything else."""
+    if img is None or img.format != 'JPEG' or not getattr(img, 'quantization', None):
+        return {}
+    settings = {'qtables': img.quantization}
+    if img.mode == 'RGB':
+        settings['subsampling'] = JpegImagePlugin.get_sampling(img)
+    return settings
+
+class PageEncoder:
+    """
+    Output settings for pages. Without a quality, JPEG pages keep the
+    quantization tables and subsampling of their source page.
+    With webp=True, quality is the WebP quality target (default 80).
+    """
+    def __init__(self, quality=None, progressive=False, optimize=False, subsampling='keep', webp=False, grayscale=True):
+        self.quality = quality
+        self.progressive = progressive
+        self.optimize = optimize
+        self.subsampling = subsampling
+        self.webp = webp
+        self.grayscale = grayscale
+
+    @property
+    def extension(self):
+        return '.webp' if self.webp else '.jpg'
+
+    @property
+    def params(self):
+        """The settings as a string, recorded in the run manifest with every page."""
+        if self.webp:
+            encode = f"webp-q{self.quality or 80}"
+        else:
+            encode = f"jpeg-q{self.quality or 'source'}-{self.subsampling}"
+            encode += "-progressive" * self.progressive + "-optimize" * self.optimize
+        return f"encode={encode};gray={'L' if self.grayscale else 'off'}"
+
+    def output_mode(self, img):
+        """L if the page is gray (and that's on), RGB otherwise."""
+        return 'L' if self.grayscale and is_grayscale(img) else 'RGB'
+
+    def keeps_source(self, img, mode):
+        """
+        True if the opened JPEG source img can be copied as-is when nothing
+        was cropped off, mode being the output_mode() of the page.
+        """
+        if self.webp or self.quality is not None or img.format != 'JPEG':
+            return False
+        # A gray page stored as RGB still gets its chroma dropped
+        return img.mode == mode or (img.mode == 'L' and not self.grayscale)
+
+    def jpeg_options(self, mode, source=None):
+        options = {'progressive': self.progressive, 'optimize': self.optimize}
+        settings = source_jpeg_settings(source)
+        if self.quality is not None:
+            options['quality'] = self.quality
+        elif 'qtables' in settings:
+            # One channel only needs the luminance table
+            options['qtables'] = [settings['qtables'][0]] if mode == 'L' else settings['qtables']
+        if mode == 'RGB':
+            subsampling = settings.get('subsampling', -1) if self.subsampling == 'keep' else self.subsampling
+            if subsampling != -1:
+                options['subsampling'] = subsampling
+        return options
+
+    def save(self, img, path, source=None, mode=None):
+        """
+        Saves the page in the format its extension calls for, in mode
+        (output_mode() if not given). source is the opened source page,
+        for its JPEG settings. Returns the mode saved.
+        """
+        mode = mode or self.output_mode(img)
+        if img.mode != mode:
+            img = img.convert(mode)
+        ext = os.path.splitext(path)[1].lower()
+        if ext in ('.jpg', '.jpeg'):
+            replace_file(path, lambda temp_path: img.save(temp_path, 'JPEG', **self.jpeg_options(img.mode, source)))
+        elif ext == '.webp':
+            replace_file(path, lambda temp_path: img.save(temp_path, 'WEBP', quality=self.quality or 80, method=4))
+        else:
+            # The temporary name has no extension Pillow knows, name the format
+            replace_file(path, lambda temp_path: img.save(temp_path, Image.registered_extensions()[ext], optimize=self.optimize))
+        return img.mode
+
+def add_arguments(parser, webp=True):
+    parser.add_argument('--quality', type=int,
+                        help='JPEG quality (1-95) or WebP quality target; by default JPEG pages keep the quality of their source')
+    parser.add_argument('--progressive', action='store_true', help='Save re-encoded JPEG pages progressive')
+    parser.add_argument('--optimize', action='store_true', help='Compute optimal Huffman tables for re-encoded JPEG pages (smaller, slower)')
+    parser.add_argument('--subsampling', choices=subsampling_choices, default='keep',
+                        help='Chroma subsampling of color JPEG pages (default: keep the source\'s)')
+    if webp:
+        parser.add_argument('--webp', action='store_true', help='Save pages as WebP instead of JPEG')
+    parser.add_argument('--keep-color-mode', action='store_true',
+                        help='Save gray pages with three channels like color pages')
+
+def from_args(args):
+    return PageEncoder(args.quality, args.progressive, args.optimize, args.subsampling,
+                       getattr(args, 'webp', False), not args.keep_color_mode)
@@ -0,0 +1,346 @@
+import os
+import time
+import asyncio
+import zipfile
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from cbz_unpack import extract_images
+from clean_up_folders import clean_up_folder
+from initiall_prepare import get_chapter_sources, assign_volumes, load_volume_map, process_chapter, page_stats, bytes_saved
+from last_step import ChapterNamer, place_page, get_place_function, get_first_folder, extract_volume, link_modes, report_unplaced
+from library_catalog import get_catalog
+from run_manifest import Manifest
+import page_encoder
+import metrics
+
+# Streams every chapter of input/ through unpacking, validation, preparing
+# and placing into manga/ as soon as its inputs are ready, instead of running
+# the scripts one after another over the whole library.
+#
+#   unpack (threads) -> validate (threads) -> prepare (processes) -> place (threads)
+#
+# Each stage takes chapters from a bounded queue, so a slow stage holds back
+# the ones before it. Everything that touches library.db runs on one thread,
+# the catalog connection can't be shared between threads.
+# Chapters are placed in volume and chapter order per series, their
+# manga/ names depend on the chapters before them.
+
+input_dir = "./input"
+output_dir = "./output"
+covers_dir = "./covers"
+manga_dir = "./manga"
+
+target_ratio = (1836, 2448)
+
+class Chapter:
+    """One chapter on its way through the stages."""
+    def __init__(self, series, name, volume, parts):
+        self.series = series
+        self.name = name
+        self.volume = volume
+        self.parts = parts
+        self.pages = []
+        self.prepared = None
+
+    def __str__(self):
+        return f"{self.series} {self.name}"
+
+def plan_series(series, volume_map):
+    """
+    Chapters of a series with a volume, in volume and chapter order, and the
+    chapters left without one. Runs on the catalog thread.
+    """
+    series_input_dir = os.path.join(input_dir, series)
+    with metrics.timer("scan"):
+        get_catalog().refresh_series(series_input_dir)
+    chapters = sorted(get_chapter_sources(series_input_dir))
+    volume_assignments = assign_volumes(chapters, volume_map, batch=True)
+    unresolved = [chapter for chapter in chapters if chapter not in volume_assignments]
+
+    planned = [
+        Chapter(series, chapter, volume, get_chapter_sources(series_input_dir, chapter))
+        for chapter, volume in volume_assignments.items()
+    ]
+    planned.sort(key=lambda chapter: (chapter.volume, chapter.name))
+    return planned, unresolved
+
+def unpack_archive(cbz_path):
+    """Extracts a .cbz next to itself, like cbz_unpack. Returns the folder."""
+    extract_path = os.path.splitext(cbz_path)[0]
+    os.makedirs(extract_path, exist_ok=True)
+    with metrics.timer("archive"), zipfile.ZipFile(cbz_path, 'r') as cbz_file:
+        count = extract_images(cbz_file, extract_path)
+    print(f"Extracted {count} images from '{os.path.basename(cbz_path)}'")
+    return extract_path
+
+def refresh_series(series):
+    with metrics.timer("scan"):
+        get_catalog().refresh_series(os.path.join(input_dir, series))
+
+def validate_folders(executor, folders, deep):
+    for folder in folders:
+        clean_up_folder(executor, folder, deep)
+    get_catalog().commit()
+
+def prepare_chapter(series, chapter, volume, parts, encoder):
+    """
+    Runs process_chapter in a worker process, on the parts resolved by the
+    parent so the worker never opens library.db. The worker reads the series
+    manifest on its own and returns what it changed, the page stats and the
+    output pages made or kept, in page order.
+    """
+    series_input_dir = os.path.join(input_dir, series)
+    series_output_dir = os.path.join(output_dir, series)
+    os.makedirs(os.path.join(series_output_dir, volume), exist_ok=True)
+
+    manifest = Manifest(os.path.join(series_output_dir, ".manifest.json"))
+    page_stats.clear()
+    outputs = {}
+    process_chapter(series_input_dir, series_output_dir, chapter, volume, 1, target_ratio, manifest,
+                    encoder=encoder, sources=parts, outputs=outputs)
+    return manifest.changes(), dict(page_stats), [outputs[number] for number in sorted(outputs)]
+
+async def run_stage(inbox, outbox, jobs, work):
+    """
+    Runs work on the chapters from inbox, jobs at a time, and passes them on to
+    outbox. A chapter whose work fails is dropped here. None ends the stage.
+    """
+    async def worker():
+        while True:
+            chapter = await inbox.get()
+            if chapter is None:
+                # Let the other workers of this stage see it too
+                await inbox.put(None)
+                return
+            try:
+                await work(chapter)
+            except Exception as e:
+                print(f"Error processing {chapter}: {e}")
+                chapter.prepared.set_result(False)
+                continue
+            if outbox is not None:
+                await outbox.put(chapter)
+
+    await asyncio.gather(*(worker() for _ in range(jobs)))
+    if outbox is not None:
+        await outbox.put(None)
+
+class Pipeline:
+    def __init__(self, args):
+        self.args = args
+        self.loop = asyncio.get_running_loop()
+        self.catalog_executor = ThreadPoolExecutor(max_workers=1)
+        self.unpack_executor = ThreadPoolExecutor(max_workers=args.unpack_jobs)
+        self.check_executor = ThreadPoolExecutor(max_workers=args.validate_jobs)
+        self.place_executor = ThreadPoolExecutor(max_workers=args.place_jobs)
+        # Fresh interpreters for the image work, forking a process that runs threads isn't safe
+        self.process_executor = ProcessPoolExecutor(
+            max_workers=args.prepare_jobs, mp_context=multiprocessing.get_context("spawn"),
+            initializer=metrics.enable if metrics.enabled else None
+        )
+        self.encoder = page_encoder.from_args(args)
+        self.place_file = get_place_function(args.link_mode)
+        # Covers are shared between runs, never move them away
+        self.place_cover = get_place_function("copy" if args.link_mode == "move" else args.link_mode)
+        self.output_manifests = {}
+        self.unpacked = {}
+        self.unresolved = {}
+        self.started = time.perf_counter()
+        self.first_chapter = None
+
+    def in_thread(self, executor, function, *args):
+        return self.loop.run_in_executor(executor, partial(function, *args))
+
+    def close(self):
+        self.process_executor.shutdown()
+        for executor in (self.catalog_executor, self.unpack_executor, self.check_executor, self.place_executor):
+            executor.shutdown()
+
+    # Stages
+
+    async def unpack(self, chapter):
+        """Unpacks the .cbz parts of a chapter that have no folder yet."""
+        archives = [path for path in chapter.parts.values() if not os.path.isdir(path)]
+        if not archives:
+            return
+        for path in archives:
+            # Another chapter can share a part (chapter names are matched by prefix), unpack it once
+            if path not in self.unpacked:
+                self.unpacked[path] = self.in_thread(self.unpack_executor, unpack_archive, path)
+            folder = await self.unpacked[path]
+            chapter.parts = {name: folder if part == path else part for name, part in chapter.parts.items()}
+        # Keep the catalog in step with the new folders
+        await self.in_thread(self.catalog_executor, refresh_series, chapter.series)
+
+    async def validate(self, chapter):
+        await self.in_thread(self.catalog_executor, validate_folders, self.check_executor,
+                             list(chapter.parts.values()), self.args.deep)
+
+    async def prepare(self, chapter):
+        result, data = await self.in_thread(
+            self.process_executor, metrics.run_drained, prepare_chapter,
+            chapter.series, chapter.name, chapter.volume, chapter.parts, self.encoder
+        )
+        metrics.merge(data)
+        changes, stats, chapter.pages = result
+        manifest, series_stats = self.output_manifests[chapter.series]
+        manifest.merge(changes)
+        manifest.save()
+        series_stats.update(stats)
+        chapter.prepared.set_result(True)
+
+    # Placing, per series
+
+    async def place(self, manifest, place, source, target, kind, size):
+        return await self.in_thread(self.place_executor, place_page, manifest, place, source, target, kind, size)
+
+    async def place_series(self, series, chapters):
+        """Places the prepared chapters of a series in order. Returns True if all of them made it."""
+        namer = ChapterNamer(series, self.args.chapter_digits)
+        manifest = Manifest(f"{manga_dir}/{series}/.manifest.json")
+        complete = True
+        skipped = 0
+        volume = None
+
+        for chapter in chapters:
+            if chapter.volume != volume:
+                if volume is not None:
+                    await self.place_volume_cover(manifest, series, volume)
+                volume = chapter.volume
+                namer.start_volume()
+
+            if not await chapter.prepared:
+                complete = False
+                continue
+
+            current, new_path, title_current = namer.add(volume, chapter.name)
+            print(f"      - {current[1]}: {title_current}")
+            os.makedirs(new_path, exist_ok=True)
+
+            # Only the pages this run made or kept, stale output pages are removed once the series is through
+            results = await asyncio.gather(*(
+                self.place(manifest, self.place_file, page_path,
+                           namer.page_path(new_path, os.path.splitext(page_path)[1].lower()), "page",
+                           os.path.getsize(page_path))
+                for page_path in chapter.pages
+            ))
+            skipped += sum(results)
+            manifest.save()
+
+            if self.first_chapter is None:
+                self.first_chapter = time.perf_counter() - self.started
+                print(f"First chapter in {manga_dir}/ after {self.first_chapter:.1f}s")
+
+        if volume is not None:
+            await self.place_volume_cover(manifest, series, volume)
+
+        # manga/ is the final library, pages of chapters no longer in input/ are only removed with --prune
+        unplaced = report_unplaced(manifest, self.args.prune and complete and series not in self.unresolved)
+        manifest.save()
+        print(f"{series}: {skipped} pages were already in place, {unplaced}")
+        return complete
+
+    async def place_volume_cover(self, manifest, series, volume):
+        cover = f"{covers_dir}/{series}/{extract_volume(volume)}.jpg"
+        volume_path = f"{manga_dir}/{series}/{series} {volume}/"
+        first_folder = get_first_folder(volume_path) if os.path.isdir(volume_path) else None
+        if not os.path.exists(cover) or first_folder is None:
+            print(f"Cover for Vol.{extract_volume(volume)} does not exist in .mange dir")
+            return
+        await self.place(manifest, self.place_cover, cover, f"{volume_path}{first_folder}/000.jpg", "cover",
+                         os.path.getsize(cover))
+
+    def finish_series(self, series, complete):
+        """Drops the series' stale output pages once all its chapters are through."""
+        manifest, stats = self.output_manifests[series]
+        removed = manifest.remove_orphans() if complete and series not in self.unresolved else 0
+        manifest.save()
+        print(f"{series}: {stats['copied']} pages copied as-is, {stats['encoded']} pages re-encoded, "
+              f"{stats['skipped']} pages up to date, {removed} stale output pages removed")
+        print(bytes_saved(stats))
+
+    async def run(self):
+        args = self.args
+        queues = [asyncio.Queue(maxsize=args.queue_size) for _ in range(3)]
+        stages = [
+            run_stage(queues[0], queues[1], args.unpack_jobs, self.unpack),
+            # Validation runs on the catalog thread, the files of a chapter are checked --validate-jobs at a time
+            run_stage(queues[1], queues[2], 1, self.validate),
+            run_stage(queues[2], None, args.prepare_jobs, self.prepare),
+        ]
+        stage_tasks = [asyncio.create_task(stage) for stage in stages]
+
+        series_list = sorted(d for d in os.listdir(input_dir) if os.path.isdir(os.path.join(input_dir, d)))
+        placing = {}
+        for series in series_list:
+            volume_map = load_volume_map(os.path.join(args.volume_maps, f"{series}.txt"))
+            try:
+                chapters, unresolved = await self.in_thread(self.catalog_executor, plan_series, series, volume_map)
+            except ValueError as e:
+                self.unresolved[series] = [f"series skipped: {e}"]
+                continue
+            if unresolved:
+                self.unresolved[series] = unresolved
+
+            os.makedirs(os.path.join(output_dir, series), exist_ok=True)
+            self.output_manifests[series] = (Manifest(os.path.join(output_dir, series, ".manifest.json")), Counter())
+            for chapter in chapters:
+                chapter.prepared = self.loop.create_future()
+            placing[series] = asyncio.create_task(self.place_series(series, chapters))
+            for chapter in chapters:
+                await queues[0].put(chapter)
+
+        await queues[0].put(None)
+        await asyncio.gather(*stage_tasks)
+        for series, task in placing.items():
+            self.finish_series(series, await task)
+
+        print(f"Done in {time.perf_counter() - self.started:.1f}s")
+        if self.unresolved:
+            print("\nChapters without a volume (add them to the volume map):")
+            for series, chapters in self.unresolved.items():
+                print(f"{series}:")
+                for chapter in chapters:
+                    print(f"  - {chapter}")
+
+async def run_pipeline(args):
+    pipeline = Pipeline(args)
+    try:
+        await pipeline.run()
+    finally:
+        pipeline.close()
+
+def main(args):
+    asyncio.run(run_pipeline(args))
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Take every chapter in input/ through unpacking, clean-up, preparing and placing into manga/ in one run')
+    parser.add_argument('--unpack-jobs', type=int, default=2,
+                        help='Number of .cbz archives unpacked at the same time (default: 2)')
+    parser.add_argument('--validate-jobs', type=int, default=8,
+                        help='Number of files checked at the same time (default: 8)')
+    parser.add_argument('--prepare-jobs', type=int, default=os.cpu_count() or 1,
+                        help='Number of chapters cropped at the same time, one process each (default: number of CPUs)')
+    parser.add_argument('--place-jobs', type=int, default=8,
+                        help='Number of pages placed at the same time (default: 8)')
+    parser.add_argument('--queue-size', type=int, default=4,
+                        help='Chapters waiting between two stages before the earlier one pauses (default: 4)')
+    page_encoder.add_arguments(parser)
+    parser.add_argument('--deep', action='store_true',
+                        help='Also verify and fully decode every image, not just its header')
+    parser.add_argument('--link-mode', choices=link_modes, default="copy",
+                        help='How pages are placed into manga/: copy, hardlink, reflink or move (default: copy)')
+    parser.add_argument('--prune', action='store_true',
+                        help='Delete manga/ pages placed by earlier runs that this run did not place again, each one is printed')
+    parser.add_argument('--chapter-digits', type=int, default=3,
+                        help='Length of the chapter numbers in manga/ (eg. 2 = 01, 3 = 001, default: 3)')
+    parser.add_argument('--volume-maps', default="./volume_maps",
+                        help='Folder with a <series>.txt volume map per series (default: ./volume_maps)')
+    metrics.add_arguments(parser)
+
+    args = parser.parse_args()
+    metrics.run(main, args, args)
@@ -1,10 +1,42 @@
 import os
-import re
+import queue
 import tkinter as tk
-from tkinter import filedialog, messagebox
-from PIL import Image, ImageTk
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import messagebox
+from PIL import ImageTk
+from thumbnail_cache import ThumbnailCache
+from credit_pages import find_repeated_pages
+from chapter_names import parse_name
+import metrics
+
+def get_chapters(folder):
+    """
+    Returns {translator: [(chapter_path, first 5 pages + [None] + last 5 pages)]}.
+    """
+    chapters = {}
+    
+    for folder_name in sorted(os.listdir(folder)):
+        record = parse_name(folder_name)
+        if record:
+            chapter_path = os.path.join(folder, folder_name)
+            if os.path.isdir(chapter_path):
+                with metrics.timer("scan"):
+                    images = sorted([f for f in os.listdir(chapter_path) if f.lower().endswith((".jpg", ".png", ".jpeg"))])
+                if images:
+                    translator = record.translator or "Unknown"
+                    
+                    if translator not in chapters:
+                        chapters[translator] = []
+                    chapters[translator].append((chapter_path, images[:5] + [None] + images[-5:]))
+    
+    return chapters
 
 class ChapterPageViewer:
+    # Rows have a fixed height so only the ones near the viewport need widgets
+    row_height = 345
+    header_height = 40
+    overscan = 2
+
     def __init__(self, root, folder):
         self.root = root
         self.folder = folder
@@ -12,12 +44,20 @@ class ChapterPageViewer:
         self.selected_pages = set()
         self.images = {}
         self.current_translator = None
+        self.thumbnails = ThumbnailCache()
         
-        self.canvas = tk.Canvas(root)
-        self.scroll_y = tk.Scrollbar(root, orient="vertical", command=self.canvas.yview)
-        self.frame = tk.Frame(self.canvas)
+        # Thumbnails are decoded on worker threads and handed back through a queue
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        # Hashing can't be cancelled once it runs, it gets its own thread so closing doesn't wait for it
+        self.hash_executor = ThreadPoolExecutor(max_workers=1)
+        self.results = queue.Queue()
+        self.pending = {}
+        self.rows = {}
+        self.placeholder = tk.PhotoImage(width=200, height=300)
+        
+        self.canvas = tk.Canvas(root, yscrollincrement=40)
+        self.scroll_y = tk.Scrollbar(root, orient="vertical", command=self.on_scroll)
         
-        self.canvas.create_window((0, 0), window=self.frame, anchor="nw")
         self.canvas.configure(yscrollcommand=self.scroll_y.set)
         
         self.button_frame = tk.Frame(root)
@@ -51,40 +91,20 @@ class ChapterPageViewer:
         
         self.canvas.pack(side="left", fill="both", expand=True)
         self.scroll_y.pack(side="right", fill="y")
-        self.frame.bind("<Configure>", lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all")))
+        self.canvas.bind("<Configure>", lambda e: self.update_visible_rows())
+        self.canvas.bind_all("<MouseWheel>", lambda e: self.on_scroll("scroll", -1 if e.delta > 0 else 1, "units"))
+        self.canvas.bind_all("<Button-4>", lambda e: self.on_scroll("scroll", -1, "units"))
+        self.canvas.bind_all("<Button-5>", lambda e: self.on_scroll("scroll", 1, "units"))
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
         
         self.load_translator_buttons()
+        
+        # Hash head and tail pages in the background and preselect repeated ones
+        self.repeated_pages = self.hash_executor.submit(find_repeated_pages, self.chapters)
+        self.poll_id = self.root.after(30, self.poll_thumbnails)
     
     def get_chapters(self):
-        chapters = {}
-        pattern = re.compile(r"(Vol\.\d+ )?Ch\.(\d+(\.\d+)?)")
-        
-        for folder in sorted(os.listdir(self.folder)):
-            match = pattern.search(folder)
-            if match:
-                chapter_path = os.path.join(self.folder, folder)
-                if os.path.isdir(chapter_path):
-                    images = sorted([f for f in os.listdir(chapter_path) if f.lower().endswith((".jpg", ".png", ".jpeg"))])
-                    if images:
-                        translator = re.search(r"\[(.*?)\]", folder)
-                        translator = translator.group(1) if translator else "Unknown"
-                        
-                        # If translator has been processed before, get the count of their chapters
-                        translator_parts = [key for key in chapters.keys() if key.startswith(translator)]
-                        chapter_count = sum(len(chapters[part]) for part in translator_parts)
-                        
-                        # Calculate the part number based on the total number of chapters processed
-                        part_number = (chapter_count // 80) + 1
-                        new_translator_name = f"{translator} Part {part_number}"
-                        
-                        # Append the chapter to the corresponding translator part
-                        if new_translator_name not in chapters:
-                            chapters[new_translator_name] = []
-                        chapters[new_translator_name].append((chapter_path, images[:5] + [None] + images[-5:]))
-        
-        return chapters
-
-
+        return get_chapters(self.folder)
     
     def load_translator_buttons(self):
         for widget in self.translator_buttons.winfo_children():
@@ -96,34 +116,104 @@ class ChapterPageViewer:
     
     def display_chapters(self, translator=None):
         self.current_translator = translator
-        for widget in self.frame.winfo_children():
-            widget.destroy()
+        for index in list(self.rows):
+            self.remove_row(index)
+        self.canvas.delete("all")
         
         if translator and translator in self.chapters:
-            tk.Label(self.frame, text=translator, font=("Arial", 14, "bold")).pack(anchor="w", pady=10)
-            for chapter, images in self.chapters[translator]:
-                row_frame = tk.Frame(self.frame)
-                row_frame.pack(fill="x", pady=5)
-                for i, image in enumerate(images):
-                    if image is None:
-                        tk.Label(row_frame, text="...").pack(side="left", padx=10)
-                    else:
-                        self.add_image(chapter, image, row_frame, i)
+            self.canvas.create_text(10, 10, text=translator, font=("Arial", 14, "bold"), anchor="nw")
+            height = self.header_height + len(self.chapters[translator]) * self.row_height
+            self.canvas.configure(scrollregion=(0, 0, self.canvas.winfo_width(), height))
+            self.canvas.yview_moveto(0)
+            self.update_visible_rows()
+    
+    def on_scroll(self, *args):
+        self.canvas.yview(*args)
+        self.update_visible_rows()
+    
+    def update_visible_rows(self):
+        if not self.current_translator:
+            return
+        
+        chapters = self.chapters[self.current_translator]
+        top = self.canvas.canvasy(0) - self.header_height
+        bottom = self.canvas.canvasy(self.canvas.winfo_height()) - self.header_height
+        first = max(0, int(top // self.row_height) - self.overscan)
+        last = min(len(chapters), int(bottom // self.row_height) + 1 + self.overscan)
+        
+        for index in list(self.rows):
+            if not first <= index < last:
+                self.remove_row(index)
+        for index in range(first, last):
+            if index not in self.rows:
+                self.add_row(index, *chapters[index])
+    
+    def add_row(self, index, chapter, images):
+        row_frame = tk.Frame(self.canvas)
+        paths = []
+        for i, image in enumerate(images):
+            if image is None:
+                tk.Label(row_frame, text="...").pack(side="left", padx=10)
+            else:
+                paths.append(self.add_image(chapter, image, row_frame, i))
+        
+        window = self.canvas.create_window((0, self.header_height + index * self.row_height), window=row_frame, anchor="nw")
+        self.rows[index] = (window, row_frame, paths)
+    
+    def remove_row(self, index):
+        window, row_frame, paths = self.rows.pop(index)
+        for path in paths:
+            self.images.pop(path, None)
+            future = self.pending.pop(path, None)
+            if future:
+                future.cancel()
+        self.canvas.delete(window)
+        row_frame.destroy()
     
     def add_image(self, chapter, image_name, parent, position):
         image_path = os.path.join(chapter, image_name)
-        img = Image.open(image_path)
-        img.thumbnail((200, 300))
-        photo = ImageTk.PhotoImage(img)
+        color = "red" if image_path in self.selected_pages else "black"
         
-        img_label = tk.Label(parent, image=photo, highlightbackground="black", highlightthickness=15)
-        img_label.image = photo
+        img_label = tk.Label(parent, image=self.placeholder, highlightbackground=color, highlightthickness=15)
         img_label.pack(side="left", padx=5 if position < 5 else 15)
         
         img_label.bind("<Button-1>", lambda e, path=image_path, lbl=img_label: self.toggle_selection(path, lbl))
         img_label.bind("<Button-3>", lambda e, path=image_path: self.preview_image(path))
         
         self.images[image_path] = img_label
+        self.pending[image_path] = self.executor.submit(self.load_thumbnail, image_path)
+        return image_path
+    
+    def load_thumbnail(self, image_path):
+        # Runs on a worker thread, so it must not touch any Tk objects
+        try:
+            with metrics.timer("thumbnail"):
+                img = self.thumbnails.get(image_path)
+                img.load()
+            self.results.put((image_path, img))
+        except Exception as e:
+            print(f"Error loading thumbnail {image_path}: {e}")
+    
+    def poll_thumbnails(self):
+        loaded = False
+        while not self.results.empty():
+            image_path, img = self.results.get()
+            self.pending.pop(image_path, None)
+            label = self.images.get(image_path)
+            if label is not None:
+                photo = ImageTk.PhotoImage(img)
+                label.config(image=photo)
+                label.image = photo
+            loaded = True
+        
+        if loaded and not self.pending:
+            self.thumbnails.commit()
+        
+        if self.repeated_pages and self.repeated_pages.done():
+            if not self.repeated_pages.cancelled() and not self.repeated_pages.exception():
+                self.select_pages(self.repeated_pages.result())
+            self.repeated_pages = None
+        self.poll_id = self.root.after(30, self.poll_thumbnails)
     
     def toggle_selection(self, image_path, label):
         if image_path in self.selected_pages:
@@ -146,6 +236,14 @@ class ChapterPageViewer:
                         self.images[path].config(highlightbackground="red")
         print(f"Total selected: {len(self.selected_pages)}")
     
+    def select_pages(self, paths):
+        for path in paths:
+            self.selected_pages.add(path)
+            if path in self.images:
+                self.images[path].config(highlightbackground="red")
+        print(f"Preselected {len(paths)} repeated pages")
+        print(f"Total selected: {len(self.selected_pages)}")
+    
     def mass_deselect(self, index):
         if self.current_translator:
             for chapter, images in self.chapters[self.current_translator]:
@@ -166,12 +264,47 @@ class ChapterPageViewer:
             for page in self.selected_pages:
                 os.remove(page)
             messagebox.showinfo("Deleted", "Selected pages have been deleted.")
-            self.root.destroy()
+            self.close()
+    
+    def close(self):
+        self.root.after_cancel(self.poll_id)
+        self.hash_executor.shutdown(wait=False, cancel_futures=True)
+        # Only the few thumbnails being decoded right now are waited for, they use the cache
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.thumbnails.close()
+        self.root.destroy()
 
-if __name__ == "__main__":
+def auto_delete(folder, min_share=0.25, dry_run=False):
+    repeated = sorted(find_repeated_pages(get_chapters(folder), min_share=min_share))
+    for page in repeated:
+        print(f"{'Would delete' if dry_run else 'Deleting'}: {page}")
+        if not dry_run:
+            os.remove(page)
+    print(f"{len(repeated)} repeated pages {'found' if dry_run else 'deleted'}.")
+
+def open_viewer(folder):
     root = tk.Tk()
     root.title("Chapter Page Viewer")
     
-    folder_path = "."
-    app = ChapterPageViewer(root, folder_path)
+    app = ChapterPageViewer(root, folder)
     root.mainloop()
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Select and delete translator pages in chapter folders')
+    parser.add_argument('folder', nargs='?', default=".", help='Series folder with the chapter folders (default: .)')
+    parser.add_argument('--auto-delete', action='store_true',
+                       help='Delete repeated head/tail pages without opening the viewer')
+    parser.add_argument('--dry-run', action='store_true',
+                       help='With --auto-delete, only list the pages that would be deleted')
+    parser.add_argument('--min-share', type=float, default=0.25,
+                       help="Share of a translator's chapters a page must repeat in (default: 0.25)")
+    metrics.add_arguments(parser)
+    
+    args = parser.parse_args()
+    
+    if args.auto_delete:
+        metrics.run(auto_delete, args, args.folder, args.min_share, args.dry_run)
+    else:
+        metrics.run(open_viewer, args, args.folder)
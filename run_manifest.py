@@ -0,0 +1,155 @@
+import os
+import json
+import hashlib
+import threading
+
+# Per-series record of every produced page, so reruns only redo what changed.
+#
+# outputs: output path (relative to the manifest) -> source hash, processing
+#          parameters, output hash and the output's size/mtime when written
+# sources: source path -> size, mtime and hash, so unchanged sources aren't rehashed
+#
+# Pages can be checked and recorded from worker threads; hashing runs outside the lock.
+# Worker processes hand their part of a run back with changes() and merge().
+
+chunk_size = 1024 * 1024
+
+def file_hash(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class Manifest:
+    def __init__(self, path):
+        self.path = path
+        self.base_dir = os.path.dirname(os.path.abspath(path))
+        self.outputs = {}
+        self.sources = {}
+        self.seen = set()
+        self.hashed = set()
+        self.lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            self.outputs = data.get('outputs', {})
+            self.sources = data.get('sources', {})
+
+    def key(self, output_path):
+        return os.path.relpath(os.path.abspath(output_path), self.base_dir)
+
+    def source_hash(self, source_path):
+        """Hash of a source file, only read again if its size or mtime changed."""
+        stat = os.stat(source_path)
+        source_path = os.path.abspath(source_path)
+        with self.lock:
+            cached = self.sources.get(source_path)
+        if cached and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return cached[2]
+
+        value = file_hash(source_path)
+        with self.lock:
+            self.sources[source_path] = [stat.st_size, stat.st_mtime_ns, value]
+            self.hashed.add(source_path)
+        return value
+
+    def is_fresh(self, output_path, source_hash, params):
+        """
+        True if output_path was made from the same source with the same
+        parameters and hasn't been touched since. Marks it as still wanted.
+        """
+        with self.lock:
+            entry = self.outputs.get(self.key(output_path))
+        if not entry or entry['source'] != source_hash or entry['params'] != params:
+            return False
+        try:
+            stat = os.stat(output_path)
+        except FileNotFoundError:
+            return False
+        if [stat.st_size, stat.st_mtime_ns] != entry['stat']:
+            return False
+
+        with self.lock:
+            self.seen.add(self.key(output_path))
+        return True
+
+    def record(self, output_path, source_hash, params, output_hash=None):
+        stat = os.stat(output_path)
+        key = self.key(output_path)
+        entry = {
+            'source': source_hash,
+            'params': params,
+            'output': output_hash or file_hash(output_path),
+            'stat': [stat.st_size, stat.st_mtime_ns],
+        }
+        with self.lock:
+            self.outputs[key] = entry
+            self.seen.add(key)
+
+    def move(self, old_path, new_path):
+        """Follows an output that was renamed, its entry goes with it."""
+        with self.lock:
+            old_key, new_key = self.key(old_path), self.key(new_path)
+            self.outputs[new_key] = self.outputs.pop(old_key)
+            self.seen.discard(old_key)
+            self.seen.add(new_key)
+
+    def restat(self, output_path):
+        """Takes the current size/mtime of an output whose bytes didn't change (it was relinked)."""
+        stat = os.stat(output_path)
+        with self.lock:
+            entry = self.outputs.get(self.key(output_path))
+            if entry:
+                entry['stat'] = [stat.st_size, stat.st_mtime_ns]
+
+    def changes(self):
+        """Outputs this run produced or kept and sources it hashed."""
+        with self.lock:
+            return {
+                'outputs': {key: self.outputs[key] for key in self.seen},
+                'sources': {path: self.sources[path] for path in self.hashed},
+            }
+
+    def merge(self, changes):
+        """Takes over the changes() of the same manifest in another process."""
+        with self.lock:
+            self.outputs.update(changes['outputs'])
+            self.sources.update(changes['sources'])
+            self.seen.update(changes['outputs'])
+
+    def orphans(self):
+        """Outputs from earlier runs that this run didn't produce or keep and that still exist."""
+        paths = (os.path.join(self.base_dir, key) for key in self.outputs if key not in self.seen)
+        return [path for path in paths if os.path.exists(path)]
+
+    def remove_orphans(self, verbose=False):
+        """
+        Deletes outputs from earlier runs that this run didn't produce or keep,
+        printing each one with verbose. Only call this after a complete run.
+        """
+        removed = 0
+        for key in list(self.outputs):
+            if key in self.seen:
+                continue
+            output_path = os.path.join(self.base_dir, key)
+            if os.path.exists(output_path):
+                if verbose:
+                    print(f"Removing {output_path}")
+                os.remove(output_path)
+                removed += 1
+                try:
+                    # Drop folders left empty, stops at the first non-empty one
+                    os.removedirs(os.path.dirname(output_path))
+                except OSError:
+                    pass
+            del self.outputs[key]
+        return removed
+
+    def save(self):
+        os.makedirs(self.base_dir, exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with self.lock, open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'outputs': self.outputs, 'sources': self.sources}, f)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,116 @@
+import struct
+import warnings
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+from border_crop import content_profile
+
+# Long-strip (webtoon) pages: opening them past Pillow's decompression bomb
+# check and cutting them into page-height chunks at the gutters between panels.
+
+# Pages this many times taller than wide are strips
+strip_ratio = 3
+
+# Border rows needed between panels to count as a gutter
+min_gutter = 8
+
+# Smallest chunk height split_rows accepts, a cut has to move forward by at least a gutter
+min_page_height = 4 * min_gutter
+
+def is_strip(img):
+    width, height = img.size
+    return height > width * strip_ratio
+
+def open_unchecked(source):
+    """
+    Image.open without Pillow's decompression bomb check, for a path or a file
+    object. The caller checks the size itself.
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            prefix = f.read(16)
+    else:
+        source.seek(0)
+        prefix = source.read(16)
+    Image.init()
+    for format_id in Image.ID:
+        factory, accept = Image.OPEN[format_id]
+        accepted = not accept or accept(prefix)
+        if not accepted or isinstance(accepted, str):
+            continue
+        if not isinstance(source, str):
+            source.seek(0)
+        try:
+            # A path is opened (and closed again) by the image itself
+            return factory(source)
+        except (SyntaxError, IndexError, TypeError, struct.error):
+            continue
+    raise UnidentifiedImageError(f"cannot identify image file {source!r}")
+
+def open_image(source):
+    """
+    Image.open that lets strips through Pillow's decompression bomb check
+    (a 800x250000 strip trips it), but still refuses other huge images.
+    Image.MAX_IMAGE_PIXELS is only read, other threads keep their protection.
+    """
+    limit = Image.MAX_IMAGE_PIXELS
+    try:
+        with warnings.catch_warnings():
+            # Strips between the limit and twice the limit only warn
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            img = Image.open(source)
+    except Image.DecompressionBombError:
+        img = open_unchecked(source)
+
+    width, height = img.size
+    if limit and width * height > 2 * limit and not is_strip(img):
+        img.close()
+        raise Image.DecompressionBombError(
+            f"Image size ({width * height} pixels) exceeds limit of {2 * limit} pixels and isn't a strip")
+    return img
+
+def pick_gutter(content_rows, low, high, target):
+    """Middle of the gutter in rows [low, high) closest to target, or None if there is none."""
+    blank = np.flatnonzero(~content_rows[low:high]) + low
+    if not blank.size:
+        return None
+    runs = np.split(blank, np.flatnonzero(np.diff(blank) != 1) + 1)
+    gutters = [run for run in runs if len(run) >= min_gutter] or runs
+    middles = [int(run[0] + run[-1]) // 2 for run in gutters]
+    return min(middles, key=lambda middle: abs(middle - target))
+
+def split_rows(content_rows, page_height):
+    """
+    (top, bottom) row ranges of chunks about page_height tall. Cuts go through
+    the middle of a gutter between 0.5 and 1.5 page heights into the chunk,
+    or straight through at page_height if there is no gutter there.
+    Border rows at the start and end of each chunk are left out.
+    """
+    if page_height < min_page_height:
+        raise ValueError(f"page_height must be at least {min_page_height}, got {page_height}")
+    height = len(content_rows)
+    cuts = [0]
+    while height - cuts[-1] > page_height * 1.5:
+        start = cuts[-1]
+        cut = pick_gutter(content_rows, start + page_height // 2, start + page_height * 3 // 2, start + page_height)
+        # Every cut moves forward, or the strip is never through
+        cuts.append(cut if cut is not None and cut > start else start + page_height)
+    cuts.append(height)
+
+    chunks = []
+    for top, bottom in zip(cuts, cuts[1:]):
+        rows = np.flatnonzero(content_rows[top:bottom])
+        if rows.size:
+            chunks.append((top + int(rows[0]), top + int(rows[-1]) + 1))
+    return chunks
+
+def split_strip(img, border_color, tolerance, page_height):
+    """
+    Crop boxes of the page-height chunks of a strip, side margins removed.
+    Only the content profile is computed at full height, one band of rows at a time.
+    """
+    content_rows, content_cols = content_profile(img, border_color, tolerance)
+    cols = np.flatnonzero(content_cols)
+    if not cols.size:
+        return []
+    left, right = int(cols[0]), int(cols[-1]) + 1
+    return [(left, top, right, bottom) for top, bottom in split_rows(content_rows, page_height)]
@@ -0,0 +1,96 @@
+import io
+import os
+import sqlite3
+import threading
+import time
+from PIL import Image
+import metrics
+
+default_db_path = os.path.join(os.path.expanduser("~"), ".cache", "manga-parsing-tools", "thumbnails.db")
+
+class ThumbnailCache:
+    """
+    Small JPEG thumbnails stored in one SQLite file, keyed by page path,
+    mtime and size. Least recently used entries are dropped once the cache
+    grows past max_bytes. Safe to use from worker threads.
+    """
+    def __init__(self, db_path=default_db_path, thumb_size=(200, 300), max_bytes=256 * 1024 * 1024):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.thumb_size = thumb_size
+        self.max_bytes = max_bytes
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS thumbnails ("
+            " path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, data BLOB, last_used REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS thumbnails_last_used ON thumbnails (last_used)")
+        self.total_bytes = self.db.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM thumbnails").fetchone()[0]
+
+    def get(self, image_path):
+        """Returns the thumbnail of a page, making and storing it on a cache miss."""
+        image_path = os.path.abspath(image_path)
+        stat = os.stat(image_path)
+
+        with self.lock:
+            row = self.db.execute(
+                "SELECT data FROM thumbnails WHERE path = ? AND mtime = ? AND size = ?",
+                (image_path, stat.st_mtime_ns, stat.st_size)
+            ).fetchone()
+            if row:
+                self.db.execute("UPDATE thumbnails SET last_used = ? WHERE path = ?", (time.time(), image_path))
+        if row:
+            return Image.open(io.BytesIO(row[0]))
+
+        # Decode outside the lock so several misses can be made at once
+        thumb = self.make_thumbnail(image_path)
+        data = io.BytesIO()
+        thumb.save(data, "JPEG", quality=85)
+        with self.lock:
+            self.store(image_path, stat, data.getvalue())
+        return thumb
+
+    def make_thumbnail(self, image_path):
+        with metrics.timer("decode"):
+            with Image.open(image_path) as img:
+                # Let the JPEG decoder skip detail we'd throw away anyway
+                img.draft("RGB", self.thumb_size)
+                img = img.convert("RGB")
+            img.thumbnail(self.thumb_size)
+        metrics.add_bytes("decode", os.path.getsize(image_path))
+        return img
+
+    def store(self, image_path, stat, data):
+        old = self.db.execute("SELECT LENGTH(data) FROM thumbnails WHERE path = ?", (image_path,)).fetchone()
+        if old:
+            self.total_bytes -= old[0]
+
+        self.db.execute(
+            "INSERT OR REPLACE INTO thumbnails (path, mtime, size, data, last_used) VALUES (?, ?, ?, ?, ?)",
+            (image_path, stat.st_mtime_ns, stat.st_size, data, time.time())
+        )
+        self.total_bytes += len(data)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        # Drop least recently used entries until the cache is at 90% of its cap
+        target = self.max_bytes * 0.9
+        rows = self.db.execute("SELECT path, LENGTH(data) FROM thumbnails ORDER BY last_used").fetchall()
+        removed = []
+        for path, length in rows:
+            if self.total_bytes <= target:
+                break
+            removed.append((path,))
+            self.total_bytes -= length
+        self.db.executemany("DELETE FROM thumbnails WHERE path = ?", removed)
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
@@ -1,53 +1,29 @@
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from PIL import Image
-from collections import Counter
+from border_crop import get_border_color, find_bbox
+from strips import is_strip, open_image, split_strip, min_page_height
+from page_encoder import PageEncoder
+import page_encoder
+import metrics
 
 def within_tolerance(pixel, margin_color, tolerance):
     return sum((p - mc)**2 for p, mc in zip(pixel, margin_color)) <= tolerance**2
 
 def get_margin_color(image, margin_color):
-    if margin_color:
-        # If margin_color is provided, convert hex to RGB
-        return tuple(int(margin_color[i:i+2], 16) for i in (1, 3, 5))
-    
-    # Get image dimensions
-    width, height = image.size
-    
-    # Sample colors from all four corners
-    corners = [
-        image.getpixel((0, 0))[:3],          # Top-left
-        image.getpixel((width - 1, 0))[:3],  # Top-right
-        image.getpixel((0, height - 1))[:3], # Bottom-left
-        image.getpixel((width - 1, height - 1))[:3]  # Bottom-right
-    ]
-    
-    # Find the most frequent corner color
-    color_counter = Counter(corners)
-    most_common_color, most_common_count = color_counter.most_common(1)[0]
-    
-    if most_common_count >= 2:
-        # If at least two corners have the same color, use that as the margin color
-        return most_common_color
-    else:
-        # If all corners are different, calculate the average color
-        avg_color = tuple(
-            sum(channel) // len(corners) for channel in zip(*corners)
-        )
-        
-        # Determine if the average color is closer to white or black
-        avg_brightness = sum(avg_color) / 3
-        is_closer_to_white = avg_brightness > 127.5
-        
-        # Find the corner color closest to white or black based on the average
-        target_color = (255, 255, 255) if is_closer_to_white else (0, 0, 0)
-        closest_corner = min(
-            corners,
-            key=lambda color: sum((c - tc) ** 2 for c, tc in zip(color, target_color))
-        )
-        
-        return closest_corner
+    # Fixed hex color if given, otherwise vote between the four corners
+    return get_border_color(image, margin_color or 'corner')
 
 def find_crop_bounds(image, margin_color, tolerance):
+    width, height = image.size
+    return find_bbox(image, margin_color, tolerance) or (0, 0, width, height)
+
+def find_crop_bounds_per_pixel(image, margin_color, tolerance):
+    """
+    Original per-pixel implementation of find_crop_bounds.
+    Very slow, kept only as a reference to check the fast version against.
+    """
     width, height = image.size
     pixels = image.load()
     
@@ -85,23 +61,56 @@ def find_crop_bounds(image, margin_color, tolerance):
     
     return (left, top, right + 1, bottom + 1)
 
-def process_image(image_path, margin_color, tolerance):
+def trim_page(image_path, margin_color, tolerance, split_height=0, encoder=None):
+    """
+    Trims one page in place. Returns None on success or the error message,
+    so it can be run in a worker process and reported by the parent.
+    With split_height, strips are cut into chunks about that tall at the
+    gutters between panels, saved as <name>_01, <name>_02, ... instead of the page.
+    Pages keep their format, encoder decides the JPEG settings and gray pages.
+    """
+    encoder = encoder or PageEncoder()
     try:
-        with Image.open(image_path) as img:
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
+        with metrics.timer("trim"), open_image(image_path) as img:
+            with metrics.timer("decode"):
+                img.load()
+            metrics.add_bytes("decode", os.path.getsize(image_path))
             
-            margin_rgb = get_margin_color(img, margin_color)
-            crop_box = find_crop_bounds(img, margin_rgb, tolerance)
+            with metrics.timer("detect"):
+                margin_rgb = get_margin_color(img, margin_color)
+                if split_height and is_strip(img):
+                    chunk_boxes = split_strip(img, margin_rgb, tolerance, split_height)
+                else:
+                    chunk_boxes = [find_crop_bounds(img, margin_rgb, tolerance)]
             
-            cropped_img = img.crop(crop_box)
+            if len(chunk_boxes) > 1:
+                # Write the chunks one at a time, then drop the strip
+                base, ext = os.path.splitext(image_path)
+                with metrics.timer("save"):
+                    for index, box in enumerate(chunk_boxes, 1):
+                        encoder.save(img.crop(box), f"{base}_{index:02d}{ext}", img)
+                        metrics.add_bytes("save", os.path.getsize(f"{base}_{index:02d}{ext}"))
+                os.remove(image_path)
+                return None
             
-            # Overwrite the original image with the trimmed version
-            cropped_img.save(image_path)
-            print(f"Processed and overwritten: {image_path}")
+            cropped_img = img.crop(chunk_boxes[0]) if chunk_boxes else img
             
+            # Overwrite the original image with the trimmed version
+            with metrics.timer("save"):
+                encoder.save(cropped_img, image_path, img)
+            metrics.add_bytes("save", os.path.getsize(image_path))
+        return None
+    
     except Exception as e:
-        print(f"Error processing {image_path}: {str(e)}")
+        return str(e)
+
+def process_image(image_path, margin_color, tolerance, split_height=0):
+    error = trim_page(image_path, margin_color, tolerance, split_height)
+    if error is None:
+        print(f"Processed and overwritten: {image_path}")
+    else:
+        print(f"Error processing {image_path}: {error}")
+    return error
 
 def find_images(directory):
     supported_formats = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff', '.webp')
@@ -114,6 +123,15 @@ def find_images(directory):
     
     return image_paths
 
+def report_results(image_paths, results, errors):
+    total = len(image_paths)
+    for index, (image_path, error) in enumerate(zip(image_paths, results), 1):
+        if error is None:
+            print(f"[{index}/{total}] Processed and overwritten: {image_path}")
+        else:
+            print(f"[{index}/{total}] Error processing {image_path}: {error}")
+            errors.append((image_path, error))
+
 def main():
     import argparse
     
@@ -121,24 +139,59 @@ def main():
     parser.add_argument('--margin-color', type=str, help='Hex color code for margins (e.g., #FFFFFF)')
     parser.add_argument('--tolerance', type=int, default=10,
                        help='Color tolerance (0-255, default: 10)')
+    parser.add_argument('--jobs', type=int, default=1,
+                       help='Number of worker processes (default: 1, no pool)')
+    parser.add_argument('--split-strips', type=int, default=0, metavar='HEIGHT',
+                       help=f'Cut long strips (webtoons) into pages about HEIGHT pixels tall at the gaps between panels (at least {min_page_height})')
+    # Pages are overwritten in place, so they can't change to WebP here
+    page_encoder.add_arguments(parser, webp=False)
+    metrics.add_arguments(parser)
     
     args = parser.parse_args()
-    
+    if args.split_strips and args.split_strips < min_page_height:
+        parser.error(f"--split-strips must be at least {min_page_height} pixels (or 0 to leave strips whole)")
+    metrics.run(trim_pages, args, args)
+
+def trim_pages(args):
     # Get the directory where the script is located
     script_dir = os.path.dirname(os.path.abspath(__file__))
     
     # Find all images in the script directory and subdirectories
-    image_paths = find_images(script_dir)
+    with metrics.timer("scan"):
+        image_paths = find_images(script_dir)
     
     if not image_paths:
         print("No images found in the current directory or subdirectories.")
         return
     
     print(f"Found {len(image_paths)} images to process.")
-    
-    # Process each image
-    for image_path in image_paths:
-        process_image(image_path, args.margin_color, 150)
+    size_before = sum(os.path.getsize(image_path) for image_path in image_paths)
+    
+    trim = partial(trim_page, margin_color=args.margin_color, tolerance=150, split_height=args.split_strips,
+                   encoder=page_encoder.from_args(args))
+    errors = []
+    
+    if args.jobs > 1:
+        # Hand pages to the workers in chunks, results still come back in order
+        chunksize = max(1, min(32, len(image_paths) // (args.jobs * 4)))
+        if metrics.enabled:
+            # Workers send their measurements back with every result
+            with ProcessPoolExecutor(max_workers=args.jobs, initializer=metrics.enable) as executor:
+                results = executor.map(partial(metrics.run_drained, trim), image_paths, chunksize=chunksize)
+                report_results(image_paths, metrics.merged(results), errors)
+        else:
+            with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+                report_results(image_paths, executor.map(trim, image_paths, chunksize=chunksize), errors)
+    else:
+        report_results(image_paths, map(trim, image_paths), errors)
+    
+    print(f"Trimmed {len(image_paths) - len(errors)} of {len(image_paths)} images.")
+    size_after = sum(os.path.getsize(image_path) for image_path in find_images(script_dir))
+    print(f"{(size_before - size_after) / 1024 / 1024:.1f} MB saved ({size_before / 1024 / 1024:.1f} MB before)")
+    if errors:
+        print(f"\n{len(errors)} images failed:")
+        for image_path, error in errors:
+            print(f"{image_path}: {error}")
     
     print("Processing complete.")
 